@@ -1,30 +1,228 @@
-from flask import Flask, jsonify, request
-import mysql.connector
-from mysql.connector import Error
-from helpers import format_response, validate_data, generate_token, authenticate_user, token_required
+import atexit
+import os
+from flask import Blueprint, Flask, current_app, jsonify, make_response, request
+import db
+from breaker import CircuitOpen
+from catalog import Catalog
+from search_index import SearchIndex
+from sharding import Shard, ShardError, ShardedProductStore
+from config import load_config
+from helpers import (format_response, validate_data, generate_token, generate_refresh_token,
+                     verify_token, authenticate_user, token_required, credential_store)
+from db import Database, close_session, get_session, query_stats
+from products import (fetch_all_products, fetch_product, fetch_products_by_ids, search_products_by_name,
+                      insert_product, update_product_fields, update_products_batch, delete_product_by_id,
+                      price_from_db, UPDATABLE_FIELDS)
+from writeback import QueueFull, WriteBehindQueue
 
 
-app = Flask(__name__)
+api = Blueprint('api', __name__)
 
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'root',
-    'password': 'root',
-    'database': 'flask_api_db'
-}
+# Largest 'limit' accepted by full-text search
+MAX_SEARCH_LIMIT = 100
+
+
+def create_app(config=None):
+    # Create and configure the Flask application.
+    # The DB driver, JWT and XML modules are only imported when first needed.
+    app = Flask(__name__)
+    app.config.update(load_config(config))
+    app.extensions['db'] = Database(app.config)
+
+    database = app.extensions['db']
+
+    if app.config['DB_SHARDS']:
+        shards = [
+            Shard.mysql(Database({**app.config, 'DB_CONFIG': {**app.config['DB_CONFIG'], **shard_config}}),
+                        name=f"shard{index}")
+            for index, shard_config in enumerate(app.config['DB_SHARDS'])
+        ]
+        # Fan-out queries from concurrent requests share the workers; with fewer workers than
+        # pooled connections requests would queue behind each other
+        store = ShardedProductStore(
+            shards,
+            strategy=app.config['SHARD_STRATEGY'],
+            range_size=app.config['SHARD_RANGE_SIZE'],
+            max_workers=app.config['SHARD_FAN_OUT_WORKERS'] or len(shards) * app.config['DB_POOL_SIZE']
+        )
+        app.extensions['shards'] = store
+        atexit.register(store.close)
+
+    # Release the request's connection (and any it leaked) however the request ended
+    app.teardown_appcontext(lambda exception: close_session(database, exception))
+
+    if app.config['CATALOG_SNAPSHOT']:
+        app.extensions['catalog'] = Catalog(
+            lambda: load_all_products(app),
+            reload_seconds=app.config['CATALOG_RELOAD_SECONDS'],
+            max_staleness_seconds=app.config['CATALOG_MAX_STALENESS_SECONDS']
+        )
+
+    # Built from the whole table on the first full-text query, then kept up to date by writes
+    # in this process and rebuilt in the background. A stale index is still served.
+    app.extensions['search_index'] = Catalog(
+        lambda: load_all_products(app),
+        reload_seconds=app.config['SEARCH_INDEX_RELOAD_SECONDS'],
+        max_staleness_seconds=float('inf'),
+        build=SearchIndex.from_products
+    )
+
+    if app.config['WRITE_BEHIND']:
+        journal_path = app.config['WRITE_BEHIND_JOURNAL']
+        if not journal_path:
+            os.makedirs(app.instance_path, exist_ok=True)
+            journal_path = os.path.join(app.instance_path, 'write_behind.journal')
+        # Each worker process claims its own journal next to the configured one
+        write_queue = WriteBehindQueue.in_free_slot(
+            lambda updates: flush_product_updates(app, updates),
+            journal_path,
+            max_batch=app.config['WRITE_BEHIND_BATCH_SIZE'],
+            flush_seconds=app.config['WRITE_BEHIND_FLUSH_SECONDS'],
+            max_pending=app.config['WRITE_BEHIND_MAX_PENDING'],
+            enqueue_timeout=app.config['WRITE_BEHIND_ENQUEUE_TIMEOUT'],
+            is_row_error=db.is_row_error
+        )
+        app.extensions['write_behind'] = write_queue
+        # Queued updates are flushed before the process exits
+        atexit.register(write_queue.close)
+
+    app.register_blueprint(api)
+    return app
+
+
+def __getattr__(name):
+    # Build a default application on first access to `app.app`, e.g. `from app import app`.
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_db_connection():
-    # Create and return a database connection.
+    # Return the request's database session; it goes back to the pool when the request ends.
+    # While the circuit breaker is open this raises CircuitOpen, answered with 503.
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        return connection
-    except Error as e:
+        return get_session(current_app.extensions['db'])
+    except db.Error as e:
         print(f"Error connecting to MySQL: {e}")
         return None
 
 
-@app.route('/')
+def load_all_products(app):
+    # Read the whole products table, used to (re)build the catalog snapshot.
+    shards = app.extensions.get('shards')
+    if shards is not None:
+        return shards.fetch_all()
+    
+    connection = app.extensions['db'].connect()
+    try:
+        return fetch_all_products(connection)
+    finally:
+        connection.close()
+
+
+def get_product_shards():
+    # Return the sharded product store if products are split across databases, else None.
+    return current_app.extensions.get('shards')
+
+
+def get_breakers():
+    # Return {name: circuit breaker} for the database and every MySQL shard.
+    breakers = {'database': current_app.extensions['db'].breaker}
+    shards = get_product_shards()
+    if shards is not None:
+        for shard in shards.shards:
+            if shard.breaker is not None:
+                breakers[shard.name] = shard.breaker
+    return breakers
+
+
+def get_catalog_snapshot():
+    # Return the in-memory catalog snapshot if enabled and fresh enough, else None.
+    # While a circuit breaker is open the snapshot is served however old it is.
+    catalog = current_app.extensions.get('catalog')
+    if catalog is None:
+        return None
+    database_down = any(breaker.is_open() for breaker in get_breakers().values())
+    return catalog.snapshot(allow_stale=database_down)
+
+
+# In-memory views of the products table that follow committed writes
+PRODUCT_VIEWS = ('catalog', 'search_index')
+
+
+def apply_product_writes(upserts=(), deletes=(), app=None):
+    # Apply committed writes to the in-memory catalog and search index.
+    app = app or current_app
+    for name in PRODUCT_VIEWS:
+        view = app.extensions.get(name)
+        if view is not None:
+            view.apply(upserts, deletes)
+
+
+def flush_product_updates(app, updates):
+    # Write a batch of queued product updates, then apply the stored rows to the in-memory views.
+    shards = app.extensions.get('shards')
+    if shards is not None:
+        shards.update_many(updates)
+        updated_products = shards.fetch_many(list(updates))
+    else:
+        connection = app.extensions['db'].connect()
+        try:
+            update_products_batch(connection, updates)
+            updated_products = fetch_products_by_ids(connection, list(updates))
+        finally:
+            connection.close()
+
+    apply_product_writes(upserts=updated_products.values(), app=app)
+
+
+def enqueue_product_update(write_queue, id):
+    # Validate a product update and acknowledge it into the write-behind queue.
+    data = request.get_json()
+    
+    if not data:
+        return format_response(current_app, {"error": "No data provided"}, 400)
+    
+    is_valid, error_message = validate_data(data, is_update=True)
+    if not is_valid:
+        return format_response(current_app, {"error": error_message}, 400)
+    
+    fields = {key: data[key] for key in UPDATABLE_FIELDS if key in data}
+    if not fields:
+        return format_response(current_app, {"error": "No valid fields to update"}, 400)
+    
+    # Unknown ids can only be rejected up front when the catalog is in memory;
+    # otherwise the batched UPDATE simply matches no row.
+    snapshot = get_catalog_snapshot()
+    if snapshot is not None and snapshot.get(id) is None:
+        return format_response(current_app, {"error": "Product not found"}, 404)
+    
+    try:
+        write_queue.enqueue(id, fields)
+    except QueueFull as e:
+        return format_response(current_app, {"error": str(e)}, 503)
+    
+    queued_product = {'id': id, **fields, 'message': 'Product update queued'}
+    return format_response(current_app, queued_product, 202)
+
+
+@api.errorhandler(ShardError)
+def shard_error(e):
+    # A statement failed on one of the product shards.
+    return format_response(current_app, {"error": str(e)}, 500)
+
+
+@api.errorhandler(CircuitOpen)
+def circuit_open(e):
+    # The database is failing; answer at once instead of waiting on it.
+    response = make_response(format_response(current_app, {"error": str(e)}, 503))
+    response.headers['Retry-After'] = str(max(1, round(e.retry_after)))
+    return response
+
+
+@api.route('/')
 def home():
     # Home endpoint with API information.
     return jsonify({
@@ -32,12 +230,18 @@ def home():
         "version": "1.0",
         "endpoints": {
             "POST /api/auth/login": "Login and get JWT token",
+            "POST /api/auth/refresh": "Get a new JWT token with a refresh token",
             "GET /api/products": "Get all products",
             "GET /api/products/": "Get product by ID",
+            "GET /api/products?ids=1,2,3": "Get several products by ID",
             "GET /api/products/search?name=keyword": "Search products by name",
+            "GET /api/products/search?q=keywords": "Full-text search over name and description",
             "POST /api/products": "Create new product",
             "PUT /api/products/": "Update product",
-            "DELETE /api/products/": "Delete product"
+            "DELETE /api/products/": "Delete product",
+            "GET /api/admin/queries": "Per-statement query statistics",
+            "GET /api/admin/connections": "Per-route database connection counters",
+            "GET /api/admin/breaker": "Database circuit breaker state"
         },
         "authentication": {
             "test_username": "admin",
@@ -47,7 +251,7 @@ def home():
     })
 
 
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
 def login():
     # Authenticate user and return JWT token.
     data = request.get_json()
@@ -63,272 +267,382 @@ def login():
     
     if authenticate_user(username, password):
         token = generate_token(username)
+        refresh_token = generate_refresh_token(username)
         
         return jsonify({
             "message": "Login successful",
             "token": token,
+            "refresh_token": refresh_token,
             "expires_in": "1 hour"
         }), 200
     else:
         return jsonify({"error": "Invalid username or password"}), 401
 
 
-@app.route('/api/products', methods=['GET'])
+@api.route('/api/auth/refresh', methods=['POST'])
+def refresh():
+    # Exchange a refresh token for a new JWT token without re-authenticating.
+    data = request.get_json(silent=True)
+    
+    if not data or not data.get('refresh_token'):
+        return jsonify({"error": "Refresh token is required"}), 400
+    
+    payload = verify_token(data['refresh_token'], token_type='refresh')
+    if payload is None or not credential_store.has_user(payload['username']):
+        return jsonify({"error": "Invalid or expired refresh token"}), 401
+    
+    return jsonify({
+        "message": "Token refreshed",
+        "token": generate_token(payload['username']),
+        "expires_in": "1 hour"
+    }), 200
+
+
+@api.route('/api/products', methods=['GET'])
 def get_products():
-    # Get all products.
+    # Get all products, or only those listed in the 'ids' query parameter.
+    if 'ids' in request.args:
+        return get_products_by_ids(request.args['ids'])
+    
+    snapshot = get_catalog_snapshot()
+    if snapshot is not None:
+        return format_response(current_app, snapshot.all())
+    
+    shards = get_product_shards()
+    if shards is not None:
+        return format_response(current_app, shards.fetch_all())
+    
     connection = get_db_connection()
     if not connection:
-        return format_response(app, {"error": "Database connection failed"}, 500)
+        return format_response(current_app, {"error": "Database connection failed"}, 500)
     
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM products")
-        rows = cursor.fetchall()
-        
-        products = []
-        for row in rows:
-            product = {
-                'id': row[0],
-                'name': row[1],
-                'description': row[2],
-                'price': float(row[3]),
-                'stocks': row[4]
-            }
-            products.append(product)
+        products = fetch_all_products(connection)
+        return format_response(current_app, products)
+    except db.Error as e:
+        return format_response(current_app, {"error": str(e)}, 500)
+
+
+def get_products_by_ids(ids_param):
+    # Resolve a comma-separated list of IDs in one lookup, keeping the requested order.
+    try:
+        ids = [int(value) for value in ids_param.split(',') if value.strip()]
+    except ValueError:
+        return format_response(current_app, {"error": "Parameter 'ids' must be a comma-separated list of integers"}, 400)
+    
+    if not ids:
+        return format_response(current_app, {"error": "Parameter 'ids' is required"}, 400)
+    
+    max_ids = current_app.config['MAX_BATCH_IDS']
+    if len(ids) > max_ids:
+        return format_response(current_app, {"error": f"At most {max_ids} ids can be requested at once"}, 400)
+    
+    unique_ids = list(dict.fromkeys(ids))
+    
+    snapshot = get_catalog_snapshot()
+    if snapshot is not None:
+        found = {}
+        for id in unique_ids:
+            product = snapshot.get(id)
+            if product is not None:
+                found[id] = product
+    elif get_product_shards() is not None:
+        found = get_product_shards().fetch_many(unique_ids)
+    else:
+        connection = get_db_connection()
+        if not connection:
+            return format_response(current_app, {"error": "Database connection failed"}, 500)
         
-        cursor.close()
-        connection.close()
-        return format_response(app, products)
-    except Error as e:
-        return format_response(app, {"error": str(e)}, 500)
+        try:
+            found = fetch_products_by_ids(connection, unique_ids)
+        except db.Error as e:
+            return format_response(current_app, {"error": str(e)}, 500)
+    
+    return format_response(current_app, {
+        "products": [found[id] for id in ids if id in found],
+        "missing": [id for id in unique_ids if id not in found]
+    })
 
 
-@app.route('/api/products/<int:id>', methods=['GET'])
+@api.route('/api/products/<int:id>', methods=['GET'])
 def get_product(id):
     # Get a single product by ID.
+    snapshot = get_catalog_snapshot()
+    if snapshot is not None:
+        product = snapshot.get(id)
+        if product is None:
+            return jsonify({"error": "Product not found"}), 404
+        return format_response(current_app, product)
+    
+    shards = get_product_shards()
+    if shards is not None:
+        product = shards.fetch(id)
+        if product is None:
+            return jsonify({"error": "Product not found"}), 404
+        return format_response(current_app, product)
+    
     connection = get_db_connection()
     if not connection:
-        return format_response(app, {"error": "Database connection failed"}, 500)
+        return format_response(current_app, {"error": "Database connection failed"}, 500)
     
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM products WHERE id = %s", (id,))
-        row = cursor.fetchone()
+        product = fetch_product(connection, id)
         
-        cursor.close()
-        connection.close()
-        
-        if row is None:
+        if product is None:
             return jsonify({"error": "Product not found"}), 404
         
-        product = {
-            'id': row[0],
-            'name': row[1],
-            'description': row[2],
-            'price': float(row[3]),
-            'stocks': row[4]
-        }
-        
-        return format_response(app, product)
-    except Error as e:
-        return format_response(app, {"error": str(e)}, 500)
+        return format_response(current_app, product)
+    except db.Error as e:
+        return format_response(current_app, {"error": str(e)}, 500)
 
 
-@app.route('/api/products/search', methods=['GET'])
+@api.route('/api/products/search', methods=['GET'])
 def search_products():
-    # Search for products by name in query.
+    # Search for products by name in query, or full-text with the 'q' parameter.
+    query = request.args.get('q', '').strip()
+    if query:
+        return full_text_search(query)
+    
     search_name = request.args.get('name', '').strip()
     
     if not search_name:
-        return format_response(app, {"error": "Search parameter 'name' is required"}, 400)
+        return format_response(current_app, {"error": "Search parameter 'name' or 'q' is required"}, 400)
+    
+    snapshot = get_catalog_snapshot()
+    if snapshot is not None:
+        return format_response(current_app, snapshot.search(search_name))
+    
+    shards = get_product_shards()
+    if shards is not None:
+        return format_response(current_app, shards.search(search_name))
     
     connection = get_db_connection()
     if not connection:
-        return format_response(app, {"error": "Database connection failed"}, 500)
+        return format_response(current_app, {"error": "Database connection failed"}, 500)
     
     try:
-        cursor = connection.cursor()
-        search_pattern = f"%{search_name.lower()}%"
-        cursor.execute(
-            "SELECT * FROM products WHERE LOWER(name) LIKE %s",
-            (search_pattern,)
-        )
+        products = search_products_by_name(connection, search_name)
         
-        rows = cursor.fetchall()
-        
-        products = []
-        for row in rows:
-            product = {
-                'id': row[0],
-                'name': row[1],
-                'description': row[2],
-                'price': float(row[3]),
-                'stocks': row[4]
-            }
-            products.append(product)
-        
-        cursor.close()
-        connection.close()
+        return format_response(current_app, products)
+    except db.Error as e:
+        return format_response(current_app, {"error": str(e)}, 500)
+
+
+def full_text_search(query):
+    # Rank products by relevance of their name and description to the query.
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return format_response(current_app, {"error": "Parameter 'limit' must be an integer"}, 400)
+    
+    if not 1 <= limit <= MAX_SEARCH_LIMIT:
+        return format_response(current_app, {"error": f"Parameter 'limit' must be between 1 and {MAX_SEARCH_LIMIT}"}, 400)
+    
+    prefix = request.args.get('prefix', '').lower() in ('1', 'true', 'yes')
+    fuzzy = request.args.get('fuzzy', '').lower() in ('1', 'true', 'yes')
+    
+    # Searches arriving while the first build runs wait for it rather than failing
+    index = current_app.extensions['search_index'].snapshot(wait=True)
+    if index is None:
+        return format_response(current_app, {"error": "Search index is not available"}, 503)
+    
+    results = index.search(query, limit=limit, prefix=prefix, fuzzy=fuzzy)
+    ids = [id for id, score in results]
+    
+    snapshot = get_catalog_snapshot()
+    if snapshot is not None:
+        found = {}
+        for id in ids:
+            product = snapshot.get(id)
+            if product is not None:
+                found[id] = product
+    elif get_product_shards() is not None:
+        found = get_product_shards().fetch_many(ids)
+    else:
+        connection = get_db_connection()
+        if not connection:
+            return format_response(current_app, {"error": "Database connection failed"}, 500)
         
-        return format_response(app, products)
-    except Error as e:
-        return format_response(app, {"error": str(e)}, 500)
+        try:
+            found = fetch_products_by_ids(connection, ids)
+        except db.Error as e:
+            return format_response(current_app, {"error": str(e)}, 500)
+    
+    products = []
+    for id, score in results:
+        if id in found:
+            products.append({**found[id], 'score': round(score, 4)})
+    
+    return format_response(current_app, products)
 
 
-@app.route('/api/products', methods=['POST'])
+@api.route('/api/products', methods=['POST'])
 @token_required
 def create_product():
     # Create a new product.
-    connection = get_db_connection()
-    if not connection:
-        return format_response(app, {"error": "Database connection failed"}, 500)
+    shards = get_product_shards()
+    connection = None
+    if shards is None:
+        connection = get_db_connection()
+        if not connection:
+            return format_response(current_app, {"error": "Database connection failed"}, 500)
     
     try:
         data = request.get_json()
         
         if not data:
-            return format_response(app, {"error": "No data provided"}, 400)
+            return format_response(current_app, {"error": "No data provided"}, 400)
         
         is_valid, error_message = validate_data(data)
         if not is_valid:
-            return format_response(app, {"error": error_message}, 400)
+            return format_response(current_app, {"error": error_message}, 400)
         
         name = data['name'].strip()
         description = data.get('description', None)
         price = float(data['price'])
         stocks = int(data.get('stocks', 0))
         
-        cursor = connection.cursor()
-        cursor.execute(
-            "INSERT INTO products (name, description, price, stocks) VALUES (%s, %s, %s, %s)",
-            (name, description, price, stocks)
-        )
-        connection.commit()
-        
-        new_id = cursor.lastrowid
-        cursor.close()
-        connection.close()
+        if shards is not None:
+            new_id = shards.insert(name, description, price, stocks)
+        else:
+            new_id = insert_product(connection, name, description, price, stocks)
         
         new_product = {
             'id': new_id,
             'name': name,
             'description': description,
-            'price': price,
+            # FLOAT keeps 7 significant digits; report (and cache) the value MySQL will return
+            'price': price_from_db(price),
             'stocks': stocks,
             'message': 'Product created successfully'
         }
+        apply_product_writes(upserts=[new_product])
         
-        return format_response(app, new_product, 201)
-    except Error as e:
-        return format_response(app, {"error": str(e)}, 500)
+        return format_response(current_app, new_product, 201)
+    except db.Error as e:
+        return format_response(current_app, {"error": str(e)}, 500)
 
 
-@app.route('/api/products/<int:id>', methods=['PUT'])
+@api.route('/api/products/<int:id>', methods=['PUT'])
 @token_required
 def update_product(id):
     # Update an existing product.
-    connection = get_db_connection()
-    if not connection:
-        return format_response(app, {"error": "Database connection failed"}, 500)
+    write_queue = current_app.extensions.get('write_behind')
+    if write_queue is not None:
+        return enqueue_product_update(write_queue, id)
+    
+    shards = get_product_shards()
+    connection = None
+    if shards is None:
+        connection = get_db_connection()
+        if not connection:
+            return format_response(current_app, {"error": "Database connection failed"}, 500)
     
     try:
         data = request.get_json()
         
         if not data:
-            return format_response(app, {"error": "No data provided"}, 400)
+            return format_response(current_app, {"error": "No data provided"}, 400)
 
         is_valid, error_message = validate_data(data, is_update=True)
         if not is_valid:
-            connection.close()
-            return format_response(app, {"error": error_message}, 400)
+            return format_response(current_app, {"error": error_message}, 400)
         
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM products WHERE id = %s", (id,))
-        existing_product = cursor.fetchone()
-        
-        if existing_product is None:
-            cursor.close()
-            connection.close()
-            return format_response(app, {"error": "Product not found"}, 404)
+        existing = shards.fetch(id) if shards is not None else fetch_product(connection, id)
+        if existing is None:
+            return format_response(current_app, {"error": "Product not found"}, 404)
 
-        update_fields = []
-        update_values = []
+        fields = {key: data[key] for key in UPDATABLE_FIELDS if key in data}
         
-        if 'name' in data:
-            update_fields.append("name = %s")
-            update_values.append(data['name'])
-        if 'description' in data:
-            update_fields.append("description = %s")
-            update_values.append(data['description'])
-        if 'price' in data:
-            update_fields.append("price = %s")
-            update_values.append(data['price'])
-        if 'stocks' in data:
-            update_fields.append("stocks = %s")
-            update_values.append(data['stocks'])
+        if not fields:
+            return format_response(current_app, {"error": "No valid fields to update"}, 400)
         
-        if not update_fields:
-            cursor.close()
-            connection.close()
-            return format_response(app, {"error": "No valid fields to update"}, 400)
-        
-        update_values.append(id)
-        update_query = f"UPDATE products SET {', '.join(update_fields)} WHERE id = %s"
-        cursor.execute(update_query, tuple(update_values))
-        connection.commit()
-        
-        cursor.execute("SELECT * FROM products WHERE id = %s", (id,))
-        row = cursor.fetchone()
-        cursor.close()
-        connection.close()
+        if shards is not None:
+            shards.update(id, fields)
+            updated_product = shards.fetch(id)
+        else:
+            update_product_fields(connection, id, fields)
+            updated_product = fetch_product(connection, id)
+        apply_product_writes(upserts=[updated_product])
         
-        updated_product = {
-            'id': row[0],
-            'name': row[1],
-            'description': row[2],
-            'price': float(row[3]),
-            'stocks': row[4],
-            'message': 'Product updated successfully'
-        }
+        updated_product['message'] = 'Product updated successfully'
         
-        return format_response(app, updated_product)
-    except Error as e:
-        return format_response(app, {"error": str(e)}, 500)
+        return format_response(current_app, updated_product)
+    except db.Error as e:
+        return format_response(current_app, {"error": str(e)}, 500)
 
 
-@app.route('/api/products/<int:id>', methods=['DELETE'])
+@api.route('/api/products/<int:id>', methods=['DELETE'])
 @token_required
 def delete_product(id):
     # Delete a product by ID.
-    connection = get_db_connection()
-    if not connection:
-        return format_response(app, {"error": "Database connection failed"}, 500)
+    shards = get_product_shards()
+    connection = None
+    if shards is None:
+        connection = get_db_connection()
+        if not connection:
+            return format_response(current_app, {"error": "Database connection failed"}, 500)
 
     
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM products WHERE id = %s", (id,))
-        existing_product = cursor.fetchone()
-        
-        if existing_product is None:
-            cursor.close()
-            connection.close()
-            return format_response(app, {"error": "Product not found"}, 404)
+        existing = shards.fetch(id) if shards is not None else fetch_product(connection, id)
+        if existing is None:
+            return format_response(current_app, {"error": "Product not found"}, 404)
 
-        cursor.execute("DELETE FROM products WHERE id = %s", (id,))
-        connection.commit()
-        cursor.close()
-        connection.close()
+        if shards is not None:
+            shards.delete(id)
+        else:
+            delete_product_by_id(connection, id)
+        apply_product_writes(deletes=[id])
         
         delete_product = {
             "message": "Product deleted successfully",
             "id": id
         }
         
-        return format_response(app, delete_product)
-    except Error as e:
-        return format_response(app, {"error": str(e)}, 500)
+        return format_response(current_app, delete_product)
+    except db.Error as e:
+        return format_response(current_app, {"error": str(e)}, 500)
+
+
+@api.route('/api/admin/queries', methods=['GET'])
+@token_required
+def get_query_stats():
+    # Get aggregated statistics for every SQL statement fingerprint.
+    if request.args.get('reset', '').lower() in ('1', 'true'):
+        query_stats.reset()
+        return format_response(current_app, {"message": "Query statistics reset"})
+
+    return format_response(current_app, query_stats.snapshot())
+
+
+@api.route('/api/admin/connections', methods=['GET'])
+@token_required
+def get_connection_stats():
+    # Get connection checkout, leak and cancellation counters per route.
+    return format_response(current_app, current_app.extensions['db'].metrics.snapshot())
+
+
+@api.route('/api/admin/write-behind', methods=['GET'])
+@token_required
+def get_write_behind_state():
+    # Get the write-behind queue counters and the updates that had to be dropped.
+    write_queue = current_app.extensions.get('write_behind')
+    if write_queue is None:
+        return format_response(current_app, {"error": "Write-behind is disabled"}, 404)
+    return format_response(current_app, {
+        "pending": write_queue.pending_count(),
+        "stats": dict(write_queue.stats),
+        "dead_letters": list(write_queue.dead_letters)
+    })
+
+
+@api.route('/api/admin/breaker', methods=['GET'])
+@token_required
+def get_breaker_state():
+    # Get the state and transition counters of the database circuit breakers.
+    return format_response(current_app, {name: breaker.snapshot() for name, breaker in get_breakers().items()})
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,80 @@
+import hashlib
+import hmac
+import os
+import threading
+
+# ================ Credential Store ================
+
+HASH_ALGORITHM = 'pbkdf2_sha256'
+HASH_ITERATIONS = 100_000
+
+
+def hash_password(password, salt=None, iterations=HASH_ITERATIONS):
+    # Hash a password as "pbkdf2_sha256$<iterations>$<salt>$<hash>" with a random salt.
+    salt = salt or os.urandom(16).hex()
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), iterations)
+    return f"{HASH_ALGORITHM}${iterations}${salt}${digest.hex()}"
+
+
+def check_password(password, password_hash):
+    # Check a password against a stored hash in constant time.
+    algorithm, iterations, salt, expected = password_hash.split('$')
+    if algorithm != HASH_ALGORITHM:
+        return False
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+class CredentialStore:
+    # Users with salted password hashes. Hashing is deliberately slow, so credentials that
+    # were verified once are remembered as a keyed HMAC and later checked with a single HMAC.
+
+    def __init__(self, users=None):
+        self._lock = threading.Lock()
+        self._hashes = dict(users or {})
+        self._verified = {}
+        # Process-local key: cached digests are useless outside this process
+        self._cache_key = os.urandom(32)
+        # Hash checked for unknown users so they take as long as known ones
+        self._dummy_hash = None
+
+    def has_user(self, username):
+        return username in self._hashes
+
+    def set_password(self, username, password):
+        with self._lock:
+            self._hashes[username] = hash_password(password)
+            self._verified.pop(username, None)
+
+    def remove_user(self, username):
+        with self._lock:
+            self._hashes.pop(username, None)
+            self._verified.pop(username, None)
+
+    def verify(self, username, password):
+        # Return True if the password matches the stored hash for the user.
+        cache_digest = hmac.new(self._cache_key, password.encode(), hashlib.sha256).digest()
+
+        cached = self._verified.get(username)
+        if cached is not None and hmac.compare_digest(cached, cache_digest):
+            return True
+
+        password_hash = self._hashes.get(username)
+        if password_hash is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = hash_password('')
+            check_password(password, self._dummy_hash)
+            return False
+
+        if not check_password(password, password_hash):
+            return False
+
+        with self._lock:
+            # Do not cache a verification that raced with a password change
+            if self._hashes.get(username) == password_hash:
+                self._verified[username] = cache_digest
+        return True
+
+    def clear_cache(self):
+        with self._lock:
+            self._verified.clear()
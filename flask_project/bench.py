@@ -0,0 +1,385 @@
+# To run benchmarks: python bench.py <benchmark> [options]
+# Benchmarks that need MySQL read DB_CONFIG from the environment (see config.py).
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+# ============= REPORTING =============
+
+def report(label, samples):
+    # Print latency statistics for a list of durations in seconds.
+    samples_us = sorted(sample * 1_000_000 for sample in samples)
+    p95 = samples_us[int(len(samples_us) * 0.95) - 1] if len(samples_us) > 1 else samples_us[0]
+    print(f"{label:<32} n={len(samples_us):<7} "
+          f"avg={statistics.mean(samples_us):9.1f}us "
+          f"p50={statistics.median(samples_us):9.1f}us "
+          f"p95={p95:9.1f}us")
+
+
+def report_throughput(label, count, seconds):
+    # Print operations per second for count operations completed in the given time.
+    print(f"{label:<32} n={count:<7} {count / seconds:12.0f} ops/s")
+
+
+def timed(func, iterations):
+    # Call func the given number of times and return the duration of each call.
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+# ============= PREPARED STATEMENTS =============
+
+def bench_prepared(args):
+    # Point lookups and inserts: fresh text-protocol cursor per query vs reused prepared statement.
+    import mysql.connector
+    from config import load_config
+    from db import PreparedStatementCache, driver_config
+    from products import SELECT_PRODUCT_BY_ID, INSERT_PRODUCT
+
+    connection = mysql.connector.connect(**driver_config(load_config()['DB_CONFIG']))
+    cache = PreparedStatementCache()
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT id FROM products")
+    ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+
+    def text_lookup(i):
+        cursor = connection.cursor()
+        cursor.execute(SELECT_PRODUCT_BY_ID, (ids[i % len(ids)],))
+        cursor.fetchone()
+        cursor.close()
+
+    def prepared_lookup(i):
+        cursor = cache.get(connection, SELECT_PRODUCT_BY_ID)
+        cursor.execute(SELECT_PRODUCT_BY_ID, (ids[i % len(ids)],))
+        cursor.fetchall()
+
+    def text_insert(i):
+        cursor = connection.cursor()
+        cursor.execute(INSERT_PRODUCT, (f"Bench {i}", None, 9.99, i))
+        cursor.close()
+
+    def prepared_insert(i):
+        cursor = cache.get(connection, INSERT_PRODUCT)
+        cursor.execute(INSERT_PRODUCT, (f"Bench {i}", None, 9.99, i))
+
+    # Warm up both paths so the first prepare is not counted
+    text_lookup(0)
+    prepared_lookup(0)
+
+    report("point lookup (text)", timed(text_lookup, args.iterations))
+    report("point lookup (prepared)", timed(prepared_lookup, args.iterations))
+
+    # Inserts run in one transaction that is rolled back so the table is left untouched
+    connection.start_transaction()
+    try:
+        report("insert (text)", timed(text_insert, args.iterations))
+        report("insert (prepared)", timed(prepared_insert, args.iterations))
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+# ============= COLD START =============
+
+STARTUP_SCRIPT = (
+    "import time; started = time.perf_counter(); "
+    "import app; app.create_app(); "
+    "print(time.perf_counter() - started)"
+)
+
+# Modules that must stay out of the cold-start path
+LAZY_MODULES = ('mysql.connector', 'jwt', 'xml.etree.ElementTree')
+
+
+def bench_startup(args):
+    # Import the app and build it in fresh interpreters; fail if the median exceeds the budget.
+    here = os.path.dirname(os.path.abspath(__file__))
+    import_samples = []
+    process_samples = []
+
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT],
+                                capture_output=True, text=True, check=True, cwd=here)
+        process_samples.append(time.perf_counter() - started)
+        import_samples.append(float(result.stdout.strip()))
+
+    report("import + create_app()", import_samples)
+    report("interpreter cold start", process_samples)
+
+    check = (
+        "import sys, app; app.create_app(); "
+        f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    eager = subprocess.run([sys.executable, '-c', check],
+                           capture_output=True, text=True, check=True, cwd=here).stdout.strip()
+    if eager:
+        print(f"Eagerly imported: {eager}")
+
+    median_ms = statistics.median(import_samples) * 1000
+    print(f"Budget: {args.budget_ms:.0f} ms, median: {median_ms:.1f} ms")
+    if median_ms > args.budget_ms or eager:
+        sys.exit(1)
+
+
+# ============= TOKEN ISSUANCE =============
+
+def bench_auth(args):
+    # Credential checks and token issuance: hashing/signing on every call vs the cached paths.
+    import json
+    import jwt
+    from datetime import datetime, timedelta
+    from app import create_app
+    from auth import check_password
+    import helpers
+
+    password_hash = helpers.USERS['admin']
+
+    def legacy_token(i):
+        payload = {
+            'username': 'admin',
+            'exp': datetime.utcnow() + timedelta(hours=helpers.JWT_EXPIRATION_HOURS),
+            'iat': datetime.utcnow()
+        }
+        jwt.encode(payload, helpers.SECRET_KEY, algorithm=helpers.JWT_ALGORITHM)
+
+    def measure(label, func, iterations):
+        started = time.perf_counter()
+        for i in range(iterations):
+            func(i)
+        report_throughput(label, iterations, time.perf_counter() - started)
+
+    measure("verify password (pbkdf2)", lambda i: check_password('admin123', password_hash),
+            max(args.iterations // 100, 10))
+    measure("verify password (cached)", lambda i: helpers.authenticate_user('admin', 'admin123'),
+            args.iterations)
+    measure("sign token every call", legacy_token, args.iterations)
+    measure("generate_token (cached)", lambda i: helpers.generate_token('admin'), args.iterations)
+
+    client = create_app({'TESTING': True}).test_client()
+    body = json.dumps({'username': 'admin', 'password': 'admin123'})
+    measure("POST /api/auth/login", lambda i: client.post('/api/auth/login', data=body,
+                                                          content_type='application/json'),
+            args.iterations)
+
+
+# ============= WRITE-BEHIND =============
+
+def bench_writeback(args):
+    # Bursts of stock updates to a few hot ids: one UPDATE + commit each vs the write-behind queue.
+    import random
+    import tempfile
+    from config import load_config
+    from db import Database
+    from products import fetch_all_products, update_product_fields, update_products_batch
+    from writeback import WriteBehindQueue
+
+    database = Database(load_config())
+    connection = database.connect()
+    originals = {product['id']: product['stocks'] for product in fetch_all_products(connection)}
+    hot_ids = sorted(originals)[:args.hot_ids]
+    updates = [(random.choice(hot_ids), {'stocks': random.randint(0, 500)}) for _ in range(args.updates)]
+
+    try:
+        started = time.perf_counter()
+        for id, fields in updates:
+            update_product_fields(connection, id, fields)
+        report_throughput("synchronous UPDATE + commit", len(updates), time.perf_counter() - started)
+
+        def flush(batch):
+            flush_connection = database.connect()
+            try:
+                update_products_batch(flush_connection, batch)
+            finally:
+                flush_connection.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            queue = WriteBehindQueue(flush, f"{directory}/write_behind.journal",
+                                     max_batch=args.batch_size, fsync=not args.no_fsync)
+            started = time.perf_counter()
+            for id, fields in updates:
+                queue.enqueue(id, fields)
+            acknowledged = time.perf_counter() - started
+            queue.close()
+            flushed = time.perf_counter() - started
+
+        report_throughput("write-behind (acknowledged)", len(updates), acknowledged)
+        report_throughput("write-behind (flushed)", len(updates), flushed)
+        print(f"batches={queue.stats['batches']} coalesced={queue.stats['coalesced']}")
+    finally:
+        update_products_batch(connection, {id: {'stocks': stocks} for id, stocks in originals.items()})
+        connection.close()
+
+
+# ============= BATCH GET =============
+
+def bench_cart(args):
+    # Rendering a cart: one GET per line item vs a single GET /api/products?ids=...
+    from app import create_app
+
+    app = create_app({'TESTING': True, 'CATALOG_SNAPSHOT': args.snapshot})
+    client = app.test_client()
+    ids = [product['id'] for product in client.get('/api/products').get_json()]
+    cart = [ids[i % len(ids)] for i in range(args.items)]
+    ids_param = ','.join(str(id) for id in cart)
+
+    def one_by_one(i):
+        for id in cart:
+            client.get(f'/api/products/{id}')
+
+    def batched(i):
+        client.get(f'/api/products?ids={ids_param}')
+
+    source = "snapshot" if args.snapshot else "MySQL"
+    report(f"{args.items} x GET /<id> ({source})", timed(one_by_one, args.iterations))
+    report(f"1 x GET ?ids= ({source})", timed(batched, args.iterations))
+
+
+# ============= FULL-TEXT SEARCH =============
+
+SEARCH_WORDS = ['wireless', 'keyboard', 'mouse', 'usb', 'hub', 'webcam', '4k', 'monitor', 'ergonomic',
+                'bluetooth', 'charger', 'cable', 'notebook', 'backpack', 'bottle', 'organizer', 'stand',
+                'portable', 'mechanical', 'optical', 'speaker', 'headset', 'ultra', 'hd', 'pro']
+
+
+def synthetic_products(count, vocabulary_size, seed=42):
+    # Generate products whose names and descriptions mix common and rare words.
+    import random
+    import string
+
+    rng = random.Random(seed)
+    rare_words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+                  for _ in range(vocabulary_size)]
+
+    def words(n):
+        return ' '.join(rng.choice(SEARCH_WORDS) if rng.random() < 0.3 else rng.choice(rare_words)
+                        for _ in range(n))
+
+    for id in range(1, count + 1):
+        yield {'id': id, 'name': words(rng.randint(2, 4)), 'description': words(rng.randint(5, 12))}
+
+
+def bench_search(args):
+    # Build time and query latency of the full-text index on a synthetic catalog.
+    from search_index import SearchIndex
+
+    products = list(synthetic_products(args.products, args.vocabulary))
+    started = time.perf_counter()
+    index = SearchIndex.from_products(products)
+    print(f"Indexed {len(index)} products in {time.perf_counter() - started:.1f}s")
+
+    queries = {
+        "common term": ('wireless', {}),
+        "two terms": ('wireless keyboard', {}),
+        "rare term": (products[len(products) // 2]['name'].split()[-1], {}),
+        "prefix": ('ergo', {'prefix': True}),
+        "typo": ('keybaord', {'fuzzy': True}),
+    }
+    for label, (query, options) in queries.items():
+        report(f"{label} ({query})", timed(lambda i: index.search(query, limit=20, **options), args.iterations))
+
+    started = time.perf_counter()
+    for product in products[:args.iterations]:
+        index.add(dict(product, description=product['description'] + ' refurbished'))
+    report_throughput("incremental update", args.iterations, time.perf_counter() - started)
+
+
+# ============= RESPONSE FORMATS =============
+
+def bench_formats(args):
+    # Encoded size and encode/decode time of a full catalog response in each format.
+    import json
+    import xml.etree.ElementTree as ET
+    from app import create_app
+    from helpers import format_response
+    import msgpack_codec
+
+    app = create_app({'TESTING': True})
+    products = [dict(product, price=round(1 + id * 0.37 % 500, 2), stocks=id % 200)
+                for id, product in enumerate(synthetic_products(args.products, 5000), start=1)]
+
+    def encode(response_format):
+        # Run the real format_response() path and return the response body.
+        with app.test_request_context(f'/api/products?format={response_format}'):
+            return format_response(app, products).get_data()
+
+    decoders = {
+        'json': json.loads,
+        'xml': ET.fromstring,
+        'msgpack': msgpack_codec.unpackb,
+    }
+    native = "native" if msgpack_codec.native_codec() is not None else "pure Python"
+    print(f"{len(products)} products, msgpack codec: {native}")
+
+    for response_format, decode in decoders.items():
+        body = encode(response_format)
+        print(f"{response_format:<8} {len(body):>12,} bytes")
+        report(f"encode {response_format}", timed(lambda i: encode(response_format), args.iterations))
+        report(f"decode {response_format}", timed(lambda i: decode(body), args.iterations))
+
+    if native == "native":
+        report("encode msgpack (pure Python)", timed(lambda i: msgpack_codec.pure_packb(products), args.iterations))
+        body = msgpack_codec.pure_packb(products)
+        report("decode msgpack (pure Python)", timed(lambda i: msgpack_codec.pure_unpackb(body), args.iterations))
+
+
+# =============================
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the products API")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    prepared = subparsers.add_parser('prepared', help="Prepared vs text-protocol point lookups and inserts")
+    prepared.add_argument('--iterations', type=int, default=2000)
+    prepared.set_defaults(func=bench_prepared)
+
+    startup = subparsers.add_parser('startup', help="Import and create_app() time in fresh interpreters")
+    startup.add_argument('--runs', type=int, default=20)
+    startup.add_argument('--budget-ms', type=float, default=300)
+    startup.set_defaults(func=bench_startup)
+
+    auth = subparsers.add_parser('auth', help="Credential verification and token issuance throughput")
+    auth.add_argument('--iterations', type=int, default=5000)
+    auth.set_defaults(func=bench_auth)
+
+    writeback = subparsers.add_parser('writeback', help="Synchronous vs write-behind product updates")
+    writeback.add_argument('--updates', type=int, default=5000)
+    writeback.add_argument('--hot-ids', type=int, default=10)
+    writeback.add_argument('--batch-size', type=int, default=100)
+    writeback.add_argument('--no-fsync', action='store_true', help="Skip fsync of the journal")
+    writeback.set_defaults(func=bench_writeback)
+
+    cart = subparsers.add_parser('cart', help="Per-item GETs vs one batch GET for a cart")
+    cart.add_argument('--items', type=int, default=50)
+    cart.add_argument('--iterations', type=int, default=200)
+    cart.add_argument('--snapshot', action='store_true', help="Serve reads from the catalog snapshot")
+    cart.set_defaults(func=bench_cart)
+
+    search = subparsers.add_parser('search', help="Full-text index build time and query latency")
+    search.add_argument('--products', type=int, default=1_000_000)
+    search.add_argument('--vocabulary', type=int, default=50_000)
+    search.add_argument('--iterations', type=int, default=50)
+    search.set_defaults(func=bench_search)
+
+    formats = subparsers.add_parser('formats', help="JSON vs XML vs MessagePack response size and encode time")
+    formats.add_argument('--products', type=int, default=10_000)
+    formats.add_argument('--iterations', type=int, default=20)
+    formats.set_defaults(func=bench_formats)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from collections import deque
+
+# ================ Circuit Breaker ================
+
+breaker_logger = logging.getLogger('circuit_breaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    # Raised instead of calling the database while the circuit is open.
+    def __init__(self, retry_after):
+        super().__init__("Database unavailable, circuit breaker is open")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    # Fails fast when most recent calls to a dependency failed.
+    #
+    # - closed: calls go through. Once at least minimum_calls outcomes were recorded in the
+    #   last window_seconds and failure_rate of them failed, the circuit opens.
+    # - open: calls are rejected with CircuitOpen for open_seconds, then the circuit goes
+    #   half-open.
+    # - half_open: up to half_open_probes calls go through as probes; the first success
+    #   closes the circuit, a failure opens it again.
+
+    def __init__(self, failure_rate=0.5, minimum_calls=10, window_seconds=30, open_seconds=15,
+                 half_open_probes=1, clock=time.monotonic):
+        self.failure_rate = failure_rate
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        # (time, succeeded) of recent calls, oldest first
+        self._outcomes = deque()
+        self._failures = 0
+        self._opened_at = None
+        self._probes = 0
+        self.transitions = {f'{a}->{b}': 0 for a, b in ((CLOSED, OPEN), (OPEN, HALF_OPEN),
+                                                        (HALF_OPEN, OPEN), (HALF_OPEN, CLOSED))}
+        self.rejected = 0
+
+    def _transition(self, state):
+        breaker_logger.warning("Circuit breaker %s -> %s", self.state, state)
+        self.transitions[f'{self.state}->{state}'] += 1
+        self.state = state
+        if state == OPEN:
+            self._opened_at = self._clock()
+        elif state == CLOSED:
+            self._outcomes.clear()
+            self._failures = 0
+        self._probes = 0
+
+    def _trim(self, now):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            if not self._outcomes.popleft()[1]:
+                self._failures -= 1
+
+    def before_call(self):
+        # Reserve a call; raises CircuitOpen if the call must not be made.
+        # Every call that goes through must be followed by record().
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_seconds - self._clock()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpen(remaining)
+                self._transition(HALF_OPEN)
+
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self.rejected += 1
+                    raise CircuitOpen(self.open_seconds)
+                self._probes += 1
+
+    def record(self, succeeded):
+        # Record the outcome of a call allowed by before_call().
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED if succeeded else OPEN)
+                return
+            if self.state == OPEN:
+                # A call started before the circuit opened
+                return
+
+            now = self._clock()
+            self._outcomes.append((now, succeeded))
+            if not succeeded:
+                self._failures += 1
+            self._trim(now)
+
+            calls = len(self._outcomes)
+            if calls >= self.minimum_calls and self._failures / calls >= self.failure_rate:
+                self._transition(OPEN)
+
+    def cancel(self):
+        # Give back a call reserved by before_call() that ended without telling anything
+        # about the dependency's health.
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def is_open(self):
+        # True while calls are being rejected (open, or half-open with a probe in flight).
+        with self._lock:
+            if self.state == OPEN:
+                return self._clock() - self._opened_at < self.open_seconds
+            return self.state == HALF_OPEN and self._probes >= self.half_open_probes
+
+    def snapshot(self):
+        # Return the current state and counters for monitoring.
+        with self._lock:
+            self._trim(self._clock())
+            calls = len(self._outcomes)
+            return {
+                'state': self.state,
+                'calls': calls,
+                'failures': self._failures,
+                'failure_rate': round(self._failures / calls, 4) if calls else 0.0,
+                'rejected': self.rejected,
+                'transitions': dict(self.transitions)
+            }
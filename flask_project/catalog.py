@@ -0,0 +1,228 @@
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+# ================ Catalog Snapshot ================
+
+catalog_logger = logging.getLogger('catalog')
+
+# `stocks` is nullable; NULL is stored as this value in the integer column
+NULL_STOCKS = -1
+
+
+class CatalogSnapshot:
+    # Immutable, columnar copy of the products table, ordered and indexed by id.
+    # Writes never modify a snapshot; they build a new one (copy-on-write), so readers
+    # can keep using the snapshot they hold without locking.
+
+    __slots__ = ('ids', 'names', 'descriptions', 'prices', 'stocks', 'lower_names', 'index', 'loaded_at')
+
+    def __init__(self, ids, names, descriptions, prices, stocks, loaded_at, lower_names=None, index=None):
+        self.ids = ids
+        self.names = names
+        self.descriptions = descriptions
+        self.prices = prices
+        self.stocks = stocks
+        if lower_names is None:
+            lower_names = tuple(name.lower() for name in names)
+        self.lower_names = lower_names
+        if index is None:
+            index = {id: position for position, id in enumerate(ids)}
+        self.index = index
+        self.loaded_at = loaded_at
+
+    @classmethod
+    def from_products(cls, products, loaded_at=None):
+        # Build a snapshot from product dictionaries.
+        products = sorted(products, key=lambda product: product['id'])
+        return cls(
+            array('q', (product['id'] for product in products)),
+            tuple(product['name'] for product in products),
+            tuple(product['description'] for product in products),
+            array('d', (product['price'] for product in products)),
+            array('q', (NULL_STOCKS if product['stocks'] is None else product['stocks']
+                        for product in products)),
+            time.monotonic() if loaded_at is None else loaded_at
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _product(self, position):
+        stocks = self.stocks[position]
+        return {
+            'id': self.ids[position],
+            'name': self.names[position],
+            'description': self.descriptions[position],
+            'price': self.prices[position],
+            'stocks': None if stocks == NULL_STOCKS else stocks
+        }
+
+    def get(self, id):
+        # Return a single product by ID, or None if it does not exist.
+        position = self.index.get(id)
+        return self._product(position) if position is not None else None
+
+    def all(self):
+        # Return every product, ordered by id.
+        return [self._product(position) for position in range(len(self.ids))]
+
+    def search(self, name):
+        # Return products whose name contains the given text, case-insensitive.
+        name = name.lower()
+        return [self._product(position)
+                for position, lower_name in enumerate(self.lower_names) if name in lower_name]
+
+    def apply(self, upserts=(), deletes=()):
+        # Return a new snapshot with the given products inserted/replaced and ids removed.
+        # Only the columns are copied; existing ids are patched in place, new ids are inserted
+        # at their sorted position, and index entries are only rewritten for shifted positions.
+        ids = array('q', self.ids)
+        prices = array('d', self.prices)
+        stocks = array('q', self.stocks)
+        names = list(self.names)
+        descriptions = list(self.descriptions)
+        lower_names = list(self.lower_names)
+        index = dict(self.index)
+
+        def reindex_from(start):
+            for position in range(start, len(ids)):
+                index[ids[position]] = position
+
+        for product in upserts:
+            id = product['id']
+            row_stocks = NULL_STOCKS if product['stocks'] is None else product['stocks']
+            position = index.get(id)
+            if position is None:
+                position = bisect_left(ids, id)
+                ids.insert(position, id)
+                prices.insert(position, product['price'])
+                stocks.insert(position, row_stocks)
+                names.insert(position, product['name'])
+                descriptions.insert(position, product['description'])
+                lower_names.insert(position, product['name'].lower())
+                reindex_from(position)
+            else:
+                prices[position] = product['price']
+                stocks[position] = row_stocks
+                names[position] = product['name']
+                descriptions[position] = product['description']
+                lower_names[position] = product['name'].lower()
+
+        for id in deletes:
+            position = index.pop(id, None)
+            if position is None:
+                continue
+            for column in (ids, prices, stocks, names, descriptions, lower_names):
+                del column[position]
+            reindex_from(position)
+
+        return CatalogSnapshot(ids, tuple(names), tuple(descriptions), prices, stocks, self.loaded_at,
+                               lower_names=tuple(lower_names), index=index)
+
+
+class Catalog:
+    # Holds the current snapshot for the process and swaps it atomically.
+    # `build` turns the full products table into a snapshot; any object with `loaded_at`
+    # and an `apply(upserts, deletes)` returning the updated object can be kept this way.
+    #
+    # Staleness bounds:
+    # - writes made through this process are applied right after they commit;
+    # - writes made elsewhere (other workers, direct SQL) show up after the next reload,
+    #   i.e. within reload_seconds plus the time a reload takes;
+    # - if reloads keep failing, the snapshot is served for at most max_staleness_seconds
+    #   after it was loaded; after that snapshot() returns None and callers go to the DB.
+
+    def __init__(self, loader, reload_seconds=30, max_staleness_seconds=300,
+                 build=CatalogSnapshot.from_products):
+        self._loader = loader
+        self._build = build
+        self.reload_seconds = reload_seconds
+        self.max_staleness_seconds = max_staleness_seconds
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._reloading = False
+        self._writes_during_reload = []
+        self._thread = None
+        self._stopped = threading.Event()
+        # Set once the first load has finished, successfully or not
+        self._first_load = threading.Event()
+
+    def snapshot(self, allow_stale=False, wait=False):
+        # Return the current snapshot, or None if it is missing or too stale to serve.
+        # With allow_stale, any snapshot is returned regardless of its age. With wait, a
+        # caller arriving while the first load is still running waits for it instead of
+        # getting None.
+        if self._thread is None:
+            self.start()
+        if wait:
+            self._first_load.wait()
+
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        if not allow_stale and time.monotonic() - snapshot.loaded_at > self.max_staleness_seconds:
+            return None
+        return snapshot
+
+    def start(self):
+        # Load the first snapshot and start the periodic reload thread.
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._reload_loop, name='catalog-reload', daemon=True)
+
+        try:
+            self.reload()
+        finally:
+            self._first_load.set()
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _reload_loop(self):
+        while not self._stopped.wait(self.reload_seconds):
+            self.reload()
+
+    def reload(self):
+        # Replace the snapshot with a full copy of the table. Writes applied while the
+        # table was being read are replayed on top so they are not lost.
+        with self._lock:
+            self._reloading = True
+            self._writes_during_reload = []
+
+        try:
+            products = self._loader()
+        except Exception as e:
+            catalog_logger.warning("Catalog reload failed: %s", e)
+            with self._lock:
+                self._reloading = False
+            return False
+
+        snapshot = self._build(products)
+        with self._lock:
+            for upserts, deletes in self._writes_during_reload:
+                snapshot = snapshot.apply(upserts, deletes)
+            self._snapshot = snapshot
+            self._reloading = False
+            self._writes_during_reload = []
+        return True
+
+    def apply(self, upserts=(), deletes=()):
+        # Apply committed writes to the current snapshot.
+        upserts = [dict(product) for product in upserts]
+        deletes = list(deletes)
+        with self._lock:
+            if self._reloading:
+                self._writes_during_reload.append((upserts, deletes))
+            if self._snapshot is not None:
+                self._snapshot = self._snapshot.apply(upserts, deletes)
+
+    def upsert(self, product):
+        self.apply(upserts=[product])
+
+    def delete(self, id):
+        self.apply(deletes=[id])
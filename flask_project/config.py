@@ -0,0 +1,96 @@
+import json
+import os
+
+# ================ Configuration ================
+
+# Every setting can be overridden with an environment variable of the same name
+# (DB_CONFIG is built from DB_HOST, DB_PORT, DB_USER, DB_PASSWORD and DB_NAME).
+
+
+def env_bool(name, default):
+    # Read a boolean flag such as "1", "true" or "yes" from the environment.
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def env_json(name, default):
+    value = os.environ.get(name)
+    return json.loads(value) if value else default
+
+
+def load_config(overrides=None):
+    # Build the application configuration from the environment, then apply overrides.
+    config = {
+        'DB_CONFIG': {
+            'host': os.environ.get('DB_HOST', 'localhost'),
+            'port': env_int('DB_PORT', 3306),
+            'user': os.environ.get('DB_USER', 'root'),
+            'password': os.environ.get('DB_PASSWORD', 'root'),
+            'database': os.environ.get('DB_NAME', 'flask_api_db'),
+            # Seconds to wait for the server to accept a connection / answer a statement
+            'connection_timeout': env_int('DB_CONNECT_TIMEOUT_SECONDS', 5),
+            'read_timeout': env_int('DB_READ_TIMEOUT_SECONDS', 10)
+        },
+        'DB_POOL_SIZE': env_int('DB_POOL_SIZE', 5),
+        # Server-side limits set on every pooled connection: SELECTs running longer than
+        # DB_STATEMENT_TIMEOUT_MS are aborted, row lock waits give up after DB_LOCK_WAIT_TIMEOUT_SECONDS
+        'DB_STATEMENT_TIMEOUT_MS': env_int('DB_STATEMENT_TIMEOUT_MS', 5000),
+        'DB_LOCK_WAIT_TIMEOUT_SECONDS': env_int('DB_LOCK_WAIT_TIMEOUT_SECONDS', 5),
+        # Keep server-side prepared statements per pooled connection for the fixed product queries
+        'USE_PREPARED_STATEMENTS': env_bool('USE_PREPARED_STATEMENTS', True),
+        # Statements slower than the threshold are logged, optionally with their EXPLAIN plan
+        'QUERY_TRACE_CONFIG': {
+            'slow_threshold_ms': env_float('SLOW_QUERY_THRESHOLD_MS', 100),
+            'explain_slow': env_bool('EXPLAIN_SLOW_QUERIES', False)
+        },
+        # Stop calling MySQL for a while when most recent calls failed (see breaker.py)
+        'CIRCUIT_BREAKER_CONFIG': {
+            'failure_rate': env_float('DB_BREAKER_FAILURE_RATE', 0.5),
+            'minimum_calls': env_int('DB_BREAKER_MINIMUM_CALLS', 10),
+            'window_seconds': env_float('DB_BREAKER_WINDOW_SECONDS', 30),
+            'open_seconds': env_float('DB_BREAKER_OPEN_SECONDS', 15),
+            'half_open_probes': env_int('DB_BREAKER_HALF_OPEN_PROBES', 1)
+        },
+        # Split products across several databases (see sharding.py). A list of connection
+        # settings merged over DB_CONFIG, e.g. DB_SHARDS='[{"database": "shop0"}, {"database": "shop1"}]'
+        'DB_SHARDS': env_json('DB_SHARDS', None),
+        # 'hash' (id modulo the number of shards) or 'range' (SHARD_RANGE_SIZE consecutive ids per shard)
+        'SHARD_STRATEGY': os.environ.get('SHARD_STRATEGY', 'hash'),
+        'SHARD_RANGE_SIZE': env_int('SHARD_RANGE_SIZE', 1000000),
+        # Threads running fan-out queries for all requests; unset means one per pooled shard
+        # connection (number of shards * DB_POOL_SIZE)
+        'SHARD_FAN_OUT_WORKERS': env_int('SHARD_FAN_OUT_WORKERS', None),
+        # Largest number of ids accepted by GET /api/products?ids=...
+        'MAX_BATCH_IDS': env_int('MAX_BATCH_IDS', 100),
+        # Serve product reads from an in-memory snapshot of the products table (see catalog.py)
+        'CATALOG_SNAPSHOT': env_bool('CATALOG_SNAPSHOT', False),
+        'CATALOG_RELOAD_SECONDS': env_float('CATALOG_RELOAD_SECONDS', 30),
+        'CATALOG_MAX_STALENESS_SECONDS': env_float('CATALOG_MAX_STALENESS_SECONDS', 300),
+        # Full rebuild interval of the full-text search index (see search_index.py)
+        'SEARCH_INDEX_RELOAD_SECONDS': env_float('SEARCH_INDEX_RELOAD_SECONDS', 300),
+        # Acknowledge product updates into a local journal and write them in batches (see writeback.py)
+        'WRITE_BEHIND': env_bool('WRITE_BEHIND', False),
+        # Defaults to write_behind.journal in the Flask instance folder. Further processes use
+        # write_behind.1.journal, write_behind.2.journal, ... next to it
+        'WRITE_BEHIND_JOURNAL': os.environ.get('WRITE_BEHIND_JOURNAL'),
+        'WRITE_BEHIND_BATCH_SIZE': env_int('WRITE_BEHIND_BATCH_SIZE', 100),
+        'WRITE_BEHIND_FLUSH_SECONDS': env_float('WRITE_BEHIND_FLUSH_SECONDS', 1.0),
+        'WRITE_BEHIND_MAX_PENDING': env_int('WRITE_BEHIND_MAX_PENDING', 1000),
+        'WRITE_BEHIND_ENQUEUE_TIMEOUT': env_float('WRITE_BEHIND_ENQUEUE_TIMEOUT', 1.0)
+    }
+
+    if overrides:
+        config.update(overrides)
+    return config
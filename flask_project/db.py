@@ -0,0 +1,561 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_request_context, request
+
+from breaker import CircuitBreaker
+
+db_logger = logging.getLogger('db')
+
+
+def driver_error():
+    # Return the driver's base exception class.
+    from mysql.connector import Error
+    return Error
+
+
+def is_pool_exhausted(error):
+    # True if the pool had no free connection. The driver raises PoolError for invalid
+    # pool settings too, and only the message tells the two apart.
+    from mysql.connector import PoolError
+    return isinstance(error, PoolError) and 'pool exhausted' in str(error)
+
+
+# Connection options that older mysql-connector-python releases (such as 9.1) reject as
+# "Unsupported argument"; they are left out when the installed driver does not know them
+OPTIONAL_DRIVER_OPTIONS = ('read_timeout',)
+
+
+def driver_config(db_config):
+    # Return the connection settings the installed driver accepts.
+    from mysql.connector.constants import DEFAULT_CONFIGURATION
+    unsupported = [option for option in OPTIONAL_DRIVER_OPTIONS
+                   if option in db_config and option not in DEFAULT_CONFIGURATION]
+    if not unsupported:
+        return db_config
+    db_logger.warning("The installed mysql-connector-python does not support %s; ignoring it",
+                      ', '.join(unsupported))
+    return {option: value for option, value in db_config.items() if option not in unsupported}
+
+
+# Lock wait timeout exceeded, MAX_EXECUTION_TIME exceeded
+TIMEOUT_ERRNOS = (1205, 3024)
+
+
+def is_transient_error(error):
+    # True for errors that point at an unreachable or overloaded server rather than a bad
+    # statement; these count as failures for the circuit breaker.
+    from mysql.connector import errors
+    return (isinstance(error, (errors.OperationalError, errors.InterfaceError))
+            or getattr(error, 'errno', None) in TIMEOUT_ERRNOS)
+
+
+def is_row_error(error):
+    # True for errors caused by the values written (out of range, too long, constraint
+    # violations), which no retry can fix. Wrapping exceptions (e.g. ShardError) are
+    # looked through via their __cause__.
+    from mysql.connector import errors
+    while error is not None and not isinstance(error, errors.Error):
+        error = error.__cause__
+    return isinstance(error, (errors.DataError, errors.IntegrityError))
+
+
+def __getattr__(name):
+    # Expose the driver's base exception without importing mysql.connector at module load.
+    if name == 'Error':
+        return driver_error()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ================ Query Tracing ================
+
+slow_query_logger = logging.getLogger('slow_query')
+
+# Patterns used to collapse literal values out of a statement, applied in order.
+FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^'\\]|\\.)*'"), '?'),
+    (re.compile(r'"(?:[^"\\]|\\.)*"'), '?'),
+    (re.compile(r'%\(\w+\)s|%s'), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+EXPLAINABLE_STATEMENTS = ('select', 'update', 'delete', 'insert', 'replace')
+# Statements that never change data
+READ_ONLY_STATEMENTS = ('select', 'show', 'explain', 'describe')
+
+
+def fingerprint(statement):
+    # Normalize a SQL statement so queries differing only in values share one key.
+    normalized = statement.strip()
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        normalized = pattern.sub(replacement, normalized)
+    return normalized.lower()
+
+
+class QueryStats:
+    # Thread-safe per-fingerprint aggregates of executed statements.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def record(self, statement_fingerprint, duration_ms, params_count, rows_returned, rows_examined=None):
+        with self._lock:
+            entry = self._entries.get(statement_fingerprint)
+            if entry is None:
+                entry = {
+                    'fingerprint': statement_fingerprint,
+                    'params_count': params_count,
+                    'calls': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'rows_returned': 0,
+                    'rows_examined': 0,
+                    'slow_calls': 0
+                }
+                self._entries[statement_fingerprint] = entry
+
+            entry['calls'] += 1
+            entry['total_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+            if rows_returned > 0:
+                entry['rows_returned'] += rows_returned
+            if rows_examined is not None:
+                entry['rows_examined'] += rows_examined
+
+    def mark_slow(self, statement_fingerprint):
+        with self._lock:
+            if statement_fingerprint in self._entries:
+                self._entries[statement_fingerprint]['slow_calls'] += 1
+
+    def snapshot(self):
+        # Return aggregates ordered by total time spent, most expensive first.
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+
+        for entry in entries:
+            entry['avg_ms'] = round(entry['total_ms'] / entry['calls'], 3)
+            entry['total_ms'] = round(entry['total_ms'], 3)
+            entry['max_ms'] = round(entry['max_ms'], 3)
+
+        entries.sort(key=lambda entry: entry['total_ms'], reverse=True)
+        return entries
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+query_stats = QueryStats()
+
+
+class TracedCursor:
+    # Cursor wrapper that times every statement and feeds the query stats.
+
+    def __init__(self, cursor, connection, stats, slow_threshold_ms, explain_slow, buffer_rows=False,
+                 owner=None):
+        self._cursor = cursor
+        self._connection = connection
+        # TracedConnection told when a statement is running, so it can be cancelled
+        self._owner = owner
+        self._stats = stats
+        self._slow_threshold_ms = slow_threshold_ms
+        self._explain_slow = explain_slow
+        # Prepared cursors cannot be buffered by the driver, so rows are buffered here instead
+        self._buffer_rows = buffer_rows
+        self._rows = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        if self._rows is not None:
+            return iter(self.fetchall())
+        return iter(self._cursor)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        self._rows = None
+        self._note_write(operation)
+        self._set_in_flight(True)
+        started = time.perf_counter()
+        try:
+            result = self._cursor.execute(operation, params, *args, **kwargs)
+            if self._buffer_rows and self._cursor.with_rows:
+                self._rows = list(self._cursor.fetchall())
+        except driver_error() as e:
+            # The server answered, so nothing is left running
+            self._set_in_flight(False)
+            self._failed(e)
+            raise
+        self._set_in_flight(False)
+        duration_ms = (time.perf_counter() - started) * 1000
+        self._trace(operation, params, duration_ms)
+        return result
+
+    def _set_in_flight(self, in_flight):
+        # Anything other than a driver error (e.g. the worker being interrupted while
+        # the client went away) leaves the flag set, marking the statement as abandoned.
+        if self._owner is not None:
+            self._owner.statement_in_flight = in_flight
+
+    def _note_write(self, operation):
+        # Tell the connection its transaction changes data, so an unfinished one is worth reporting.
+        if self._owner is not None and not operation.lstrip().lower().startswith(READ_ONLY_STATEMENTS):
+            self._owner.wrote = True
+
+    def _failed(self, error):
+        if self._owner is not None:
+            self._owner.statement_failed(error)
+
+    def fetchone(self):
+        if self._rows is None:
+            return self._cursor.fetchone()
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        if self._rows is None:
+            return self._cursor.fetchall()
+        rows, self._rows = self._rows, []
+        return rows
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        seq_params = list(seq_params)
+        self._note_write(operation)
+        self._set_in_flight(True)
+        started = time.perf_counter()
+        try:
+            result = self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        except driver_error() as e:
+            self._set_in_flight(False)
+            self._failed(e)
+            raise
+        self._set_in_flight(False)
+        duration_ms = (time.perf_counter() - started) * 1000
+        self._trace(operation, seq_params[0] if seq_params else None, duration_ms)
+        return result
+
+    def _trace(self, operation, params, duration_ms):
+        statement_fingerprint = fingerprint(operation)
+        params_count = len(params) if params else 0
+        rows_returned = self._cursor.rowcount
+        is_slow = duration_ms >= self._slow_threshold_ms
+
+        plan = None
+        rows_examined = None
+        if is_slow and self._explain_slow and statement_fingerprint.startswith(EXPLAINABLE_STATEMENTS):
+            plan = self._explain(operation, params)
+            if plan:
+                rows_examined = sum(int(step.get('rows') or 0) for step in plan)
+
+        self._stats.record(statement_fingerprint, duration_ms, params_count, rows_returned, rows_examined)
+
+        if is_slow:
+            self._stats.mark_slow(statement_fingerprint)
+            slow_query_logger.warning(
+                "Slow query (%.1f ms, %d params, %d rows): %s",
+                duration_ms, params_count, rows_returned, statement_fingerprint
+            )
+            if plan:
+                slow_query_logger.warning("EXPLAIN: %s", plan)
+
+    def _explain(self, operation, params):
+        # Capture the plan on a separate untraced cursor so it does not skew the stats.
+        try:
+            cursor = self._connection.cursor(dictionary=True, buffered=True)
+            try:
+                cursor.execute(f"EXPLAIN {operation}", params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception as e:
+            slow_query_logger.warning("Could not capture EXPLAIN plan: %s", e)
+            return None
+
+
+class TracedConnection:
+    # Connection wrapper whose cursors are traced; everything else is passed through.
+
+    def __init__(self, connection, stats=query_stats, slow_threshold_ms=100, explain_slow=False,
+                 prepared_cache=None, metrics=None, route=None, breaker=None):
+        self._connection = connection
+        self._stats = stats
+        self._slow_threshold_ms = slow_threshold_ms
+        self._explain_slow = explain_slow
+        self._prepared_cache = prepared_cache
+        self._metrics = metrics
+        self.route = route
+        self._breaker = breaker
+        self.closed = False
+        self.statement_in_flight = False
+        self.failed = False
+        # True once the current transaction ran a statement that changes data
+        self.wrote = False
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def commit(self):
+        self._connection.commit()
+        self.wrote = False
+
+    def rollback(self):
+        self._connection.rollback()
+        self.wrote = False
+
+    def statement_failed(self, error):
+        # Remember failures caused by the server, reported to the circuit breaker on close.
+        if is_transient_error(error):
+            self.failed = True
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # With autocommit off a SELECT opens a transaction too; end it, or the next borrower of
+        # this pooled connection keeps reading through its old REPEATABLE READ snapshot
+        if self._connection.in_transaction:
+            try:
+                self._connection.rollback()
+            except driver_error() as e:
+                db_logger.warning("Error rolling back MySQL connection: %s", e)
+        # The checkout counts as one call: failed if any statement hit a server-side problem
+        if self._breaker is not None:
+            self._breaker.record(not self.failed)
+        if self._metrics is not None:
+            self._metrics.record(self.route, 'closed')
+        self._connection.close()
+
+    def cursor(self, *args, **kwargs):
+        # Buffer results so the row count is known as soon as the statement completes.
+        kwargs.setdefault('buffered', True)
+        cursor = self._connection.cursor(*args, **kwargs)
+        return TracedCursor(cursor, self._connection, self._stats,
+                            self._slow_threshold_ms, self._explain_slow, owner=self)
+
+    def statement_cursor(self, statement):
+        # Return a cursor for a fixed statement, reusing its server-side prepared statement if enabled.
+        # The returned cursor may be shared across requests and must not be closed by the caller.
+        if self._prepared_cache is None:
+            return self.cursor()
+
+        cursor = self._prepared_cache.get(self._connection, statement)
+        return TracedCursor(cursor, self._connection, self._stats,
+                            self._slow_threshold_ms, self._explain_slow, buffer_rows=True, owner=self)
+
+
+# ================ Connection Pool & Prepared Statements ================
+
+class PreparedStatementCache:
+    # Server-side prepared cursors kept per physical connection, keyed by the MySQL connection id.
+    # Statements are prepared once per connection and then executed with the binary protocol.
+
+    def __init__(self, max_connections=32):
+        self._lock = threading.Lock()
+        self._max_connections = max_connections
+        self._cursors = OrderedDict()
+
+    def get(self, connection, statement):
+        # The driver only skips re-preparing when the exact same string object is executed again,
+        # so statements must come from module-level constants.
+        connection_id = connection.connection_id
+        with self._lock:
+            cursors = self._cursors.get(connection_id)
+            if cursors is None:
+                cursors = {}
+                self._cursors[connection_id] = cursors
+                # Reconnected connections get new ids, so drop the oldest entries
+                while len(self._cursors) > self._max_connections:
+                    self._cursors.popitem(last=False)
+            else:
+                self._cursors.move_to_end(connection_id)
+
+        cursor = cursors.get(statement)
+        if cursor is None:
+            cursor = connection.cursor(prepared=True)
+            cursors[statement] = cursor
+        return cursor
+
+    def clear(self):
+        with self._lock:
+            self._cursors.clear()
+
+
+def create_pool(db_config, pool_size=5, pool_name='products'):
+    # Create a connection pool; sessions are not reset on return so prepared statements survive.
+    from mysql.connector import pooling
+
+    return pooling.MySQLConnectionPool(
+        pool_name=pool_name,
+        pool_size=pool_size,
+        pool_reset_session=False,
+        **driver_config(db_config)
+    )
+
+
+class Database:
+    # Per-application connection pool and prepared statement cache, created on first use.
+
+    def __init__(self, config):
+        self.db_config = config['DB_CONFIG']
+        self.pool_size = config['DB_POOL_SIZE']
+        self.trace_config = config['QUERY_TRACE_CONFIG']
+        self.statement_timeout_ms = config['DB_STATEMENT_TIMEOUT_MS']
+        self.lock_wait_timeout = config['DB_LOCK_WAIT_TIMEOUT_SECONDS']
+        self.prepared_statements = None
+        if config['USE_PREPARED_STATEMENTS']:
+            self.prepared_statements = PreparedStatementCache(max_connections=self.pool_size * 2)
+        self.metrics = ConnectionMetrics()
+        self.breaker = CircuitBreaker(**config['CIRCUIT_BREAKER_CONFIG'])
+        self._pool = None
+        self._lock = threading.Lock()
+        # MySQL connection ids whose session timeouts have been set
+        self._configured = set()
+
+    def connect(self, route=None):
+        # Check out a traced pooled connection; close() returns it to the pool.
+        # Connections checked out during a request are tracked and closed at teardown.
+        # Raises CircuitOpen without touching MySQL while the circuit breaker is open.
+        self.breaker.before_call()
+        try:
+            if self._pool is None:
+                with self._lock:
+                    if self._pool is None:
+                        self._pool = create_pool(self.db_config, self.pool_size)
+
+            raw_connection = self._pool.get_connection()
+        except driver_error() as e:
+            # An exhausted pool says nothing about the server's health; anything else (an
+            # unreachable server, a connection config the driver rejects) is a failure
+            if is_pool_exhausted(e):
+                self.breaker.cancel()
+            else:
+                self.breaker.record(False)
+            raise
+
+        try:
+            self._configure(raw_connection)
+        except Exception as e:
+            raw_connection.close()
+            self.breaker.record(not is_transient_error(e))
+            raise
+
+        if route is None and has_request_context():
+            route = request.endpoint
+        connection = TracedConnection(raw_connection, query_stats, prepared_cache=self.prepared_statements,
+                                      metrics=self.metrics, route=route, breaker=self.breaker,
+                                      **self.trace_config)
+        self.metrics.record(route, 'checked_out')
+
+        if has_request_context():
+            g.setdefault('db_connections', []).append(connection)
+        return connection
+
+    def _configure(self, connection):
+        # Set statement and lock-wait timeouts once per physical connection. Sessions are not
+        # reset when connections return to the pool, so the settings stick.
+        connection_id = connection.connection_id
+        if connection_id in self._configured:
+            return
+
+        cursor = connection.cursor()
+        cursor.execute(
+            "SET SESSION MAX_EXECUTION_TIME = %s, SESSION innodb_lock_wait_timeout = %s",
+            (int(self.statement_timeout_ms), int(self.lock_wait_timeout))
+        )
+        cursor.close()
+
+        with self._lock:
+            # Reconnected connections get new ids; forgetting old ones only costs a re-SET
+            if len(self._configured) > self.pool_size * 4:
+                self._configured.clear()
+            self._configured.add(connection_id)
+
+    def kill_query(self, connection_id):
+        # Cancel the statement running on another connection.
+        import mysql.connector
+
+        killer = mysql.connector.connect(**driver_config(self.db_config))
+        try:
+            cursor = killer.cursor()
+            cursor.execute(f"KILL QUERY {int(connection_id)}")
+            cursor.close()
+        finally:
+            killer.close()
+
+    def release(self, connection):
+        # Return a connection to the pool at the end of a request. A statement abandoned
+        # mid-flight is killed on the server and the connection is dropped rather than reused;
+        # an open transaction is rolled back.
+        try:
+            if connection.statement_in_flight:
+                self.metrics.record(connection.route, 'cancelled')
+                self.kill_query(connection.connection_id)
+                # The pool reconnects disconnected connections on their next checkout
+                connection.disconnect()
+            elif connection.in_transaction:
+                # Every read leaves a transaction open too; only abandoned writes are counted
+                if connection.wrote:
+                    self.metrics.record(connection.route, 'rolled_back')
+                connection.rollback()
+        except Exception as e:
+            db_logger.warning("Error releasing MySQL connection: %s", e)
+        finally:
+            connection.close()
+
+
+# ================ Request-Scoped Sessions ================
+
+class ConnectionMetrics:
+    # Per-route connection counters. `open` is the number of connections a route holds right
+    # now; `leaked` counts connections the route checked out and never closed itself.
+
+    EVENTS = ('checked_out', 'closed', 'leaked', 'rolled_back', 'cancelled')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, event):
+        route = route or '(no route)'
+        with self._lock:
+            counters = self._routes.get(route)
+            if counters is None:
+                counters = self._routes[route] = dict.fromkeys(self.EVENTS, 0)
+                counters['max_open'] = 0
+            counters[event] += 1
+            counters['max_open'] = max(counters['max_open'], counters['checked_out'] - counters['closed'])
+
+    def snapshot(self):
+        # Return counters per route plus the current number of open connections.
+        with self._lock:
+            routes = []
+            for route, counters in sorted(self._routes.items()):
+                entry = {'route': route, **counters}
+                entry['open'] = counters['checked_out'] - counters['closed']
+                routes.append(entry)
+        return routes
+
+
+def get_session(database):
+    # Return the request's database connection, checking one out on first use.
+    # It is closed by close_session() when the request ends.
+    if 'db_session' not in g:
+        g.db_session = database.connect()
+    return g.db_session
+
+
+def close_session(database, exception=None):
+    # Teardown hook: release the request's session and any connection the request leaked.
+    session = g.pop('db_session', None)
+    if session is not None and not session.closed:
+        database.release(session)
+
+    for connection in g.pop('db_connections', []):
+        if not connection.closed:
+            database.metrics.record(connection.route, 'leaked')
+            database.release(connection)
@@ -1,43 +1,74 @@
-import xml.etree.ElementTree as ET
 from flask import request, jsonify
 
-import jwt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 
+from auth import CredentialStore
+
+# xml.etree, jwt and the MessagePack codec are imported inside the functions that use them,
+# so importing this module (and the app) does not pay for them up front.
+
 # ================ Formatting and Validation ================
 
 def dict_to_xml(data, root_name="response"):
     # Convert dictionary or list to XML format.
+    import xml.etree.ElementTree as ET
+
+    def fill(element, value):
+        # Lists become <item> children, dictionaries become one child per key.
+        if isinstance(value, list):
+            for item in value:
+                fill(ET.SubElement(element, "item"), item)
+        elif isinstance(value, dict):
+            for key, child_value in value.items():
+                fill(ET.SubElement(element, str(key)), child_value)
+        else:
+            element.text = str(value)
+
     root = ET.Element(root_name)
-    
-    if isinstance(data, list):
-        for item in data:
-            item_elem = ET.SubElement(root, "item")
-            for key, value in item.items():
-                child = ET.SubElement(item_elem, str(key))
-                child.text = str(value)
-    elif isinstance(data, dict):
-        for key, value in data.items():
-            child = ET.SubElement(root, str(key))
-            child.text = str(value)
+    fill(root, data)
     
     return ET.tostring(root, encoding='unicode')
 
 
+def requested_format():
+    # Pick the response format: the 'format' query parameter wins, otherwise MessagePack if the
+    # client asks for it in Accept, otherwise JSON.
+    requested = request.args.get('format')
+    if requested:
+        return requested.lower()
+
+    from msgpack_codec import MSGPACK_MEDIA_TYPES
+    best = request.accept_mimetypes.best_match(('application/json',) + MSGPACK_MEDIA_TYPES)
+    return 'msgpack' if best in MSGPACK_MEDIA_TYPES else 'json'
+
+
 def format_response(app, data, status_code=200):
-    # Format response as JSON or XML based on query parameter.
-    response_format = request.args.get('format', 'json').lower()
+    # Format response as JSON, XML or MessagePack based on query parameter or Accept header.
+    response_format = requested_format()
     
     if response_format == 'xml':
         xml_data = dict_to_xml(data)
-        return app.response_class(
+        response = app.response_class(
             response=xml_data,
             status=status_code,
             mimetype='application/xml'
         )
+    elif response_format == 'msgpack':
+        from msgpack_codec import MSGPACK_MIMETYPE, packb
+        response = app.response_class(
+            response=packb(data),
+            status=status_code,
+            mimetype=MSGPACK_MIMETYPE
+        )
     else:
-        return jsonify(data), status_code
+        response = jsonify(data)
+        response.status_code = status_code
+
+    # The same URL returns JSON or MessagePack depending on Accept; caches must key on it
+    if not request.args.get('format'):
+        response.vary.add('Accept')
+    return response
 
 
 def validate_data(data, is_update=False):
@@ -87,39 +118,74 @@ def validate_data(data, is_update=False):
 SECRET_KEY = "###"
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
+REFRESH_EXPIRATION_DAYS = 7
 
-# Hardcoded user for demonstration purposes
+# A token issued less than this many seconds ago is handed out again instead of signing a new one
+TOKEN_REUSE_SECONDS = 300
+
+# Hardcoded user for demonstration purposes (password: admin123)
 USERS = {
-    "admin": "admin123"
+    "admin": "pbkdf2_sha256$100000$ebe517a8c81ab620998d8d6761e00196$bd1e49fcce2c8b3a811c16f3e28263736cf247fe9e025ef3e85b483607ee0cb2"
 }
 
+credential_store = CredentialStore(USERS)
+
+# (username, token type) -> (token, issued at)
+_issued_tokens = {}
+
+
+def _issue_token(username, token_type, lifetime):
+    # Sign a token of the given type, or reuse one issued within TOKEN_REUSE_SECONDS.
+    now = datetime.now(timezone.utc)
+
+    cached = _issued_tokens.get((username, token_type))
+    if cached is not None and (now - cached[1]).total_seconds() < TOKEN_REUSE_SECONDS:
+        return cached[0]
+
+    import jwt
 
-def generate_token(username):
-    # Generate a JWT token for authenticated user.
     payload = {
         'username': username,
-        'exp': datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS),
-        'iat': datetime.utcnow()
+        'type': token_type,
+        'exp': now + lifetime,
+        'iat': now
     }
     
     token = jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
+    _issued_tokens[(username, token_type)] = (token, now)
     return token
 
 
-def verify_token(token):
-    # Verify and decode a JWT token.
+def generate_token(username):
+    # Generate a JWT access token for authenticated user.
+    return _issue_token(username, 'access', timedelta(hours=JWT_EXPIRATION_HOURS))
+
+
+def generate_refresh_token(username):
+    # Generate a long-lived JWT refresh token used to obtain new access tokens.
+    return _issue_token(username, 'refresh', timedelta(days=REFRESH_EXPIRATION_DAYS))
+
+
+def verify_token(token, token_type='access'):
+    # Verify and decode a JWT token of the expected type.
+    import jwt
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
+    # Tokens issued before refresh tokens existed carry no type and are access tokens
+    if payload.get('type', 'access') != token_type:
+        return None
+    return payload
+
 
 def authenticate_user(username, password):
     # Authenticate user with username and password.
-    return USERS.get(username) == password
+    return credential_store.verify(username, password)
 
 
 def token_required(f):
@@ -0,0 +1,193 @@
+import struct
+
+# ================ MessagePack Encoding ================
+
+# Compact binary alternative to JSON responses (https://msgpack.org). The `msgpack` package is
+# used when it is installed; otherwise the pure-Python codec below produces the same bytes.
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+# Media types clients may send in Accept to ask for MessagePack
+MSGPACK_MEDIA_TYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack', 'application/vnd.msgpack')
+
+UINT8, UINT16, UINT32, UINT64 = (struct.Struct(f'>B{c}') for c in 'BHIQ')
+INT8, INT16, INT32, INT64 = (struct.Struct(f'>B{c}') for c in 'bhiq')
+FLOAT64 = struct.Struct('>Bd')
+LENGTH16, LENGTH32 = struct.Struct('>BH'), struct.Struct('>BI')
+
+# None until the first call, then the `msgpack` module or False if it is not installed
+_native = None
+
+
+def native_codec():
+    # Return the `msgpack` package if it is installed, else None.
+    global _native
+    if _native is None:
+        try:
+            import msgpack
+            _native = msgpack
+        except ImportError:
+            _native = False
+    return _native or None
+
+
+def packb(data):
+    # Encode data (dicts, lists, strings, numbers, booleans, None, bytes) as MessagePack.
+    native = native_codec()
+    if native is not None:
+        return native.packb(data, use_bin_type=True)
+    return pure_packb(data)
+
+
+def unpackb(payload):
+    # Decode a MessagePack payload produced by packb().
+    native = native_codec()
+    if native is not None:
+        return native.unpackb(payload, raw=False, strict_map_key=False)
+    return pure_unpackb(payload)
+
+
+def _header(parts, value, fix_prefix, fix_limit, code16, code32):
+    # Append the header of a string, array or map of `value` bytes/items.
+    if value < fix_limit:
+        parts.append(bytes((fix_prefix | value,)))
+    elif value <= 0xFFFF:
+        parts.append(LENGTH16.pack(code16, value))
+    else:
+        parts.append(LENGTH32.pack(code32, value))
+
+
+def pure_packb(data):
+    # Pure-Python MessagePack encoder.
+    parts = []
+    append = parts.append
+
+    def pack(value):
+        # bool is checked before int, since True and False are ints too
+        if value is None:
+            append(b'\xc0')
+        elif value is True:
+            append(b'\xc3')
+        elif value is False:
+            append(b'\xc2')
+        elif isinstance(value, int):
+            if 0 <= value < 0x80:
+                append(bytes((value,)))
+            elif -0x20 <= value < 0:
+                append(bytes((value & 0xFF,)))
+            elif value >= 0:
+                if value <= 0xFF:
+                    append(UINT8.pack(0xcc, value))
+                elif value <= 0xFFFF:
+                    append(UINT16.pack(0xcd, value))
+                elif value <= 0xFFFFFFFF:
+                    append(UINT32.pack(0xce, value))
+                else:
+                    append(UINT64.pack(0xcf, value))
+            elif value >= -0x80:
+                append(INT8.pack(0xd0, value))
+            elif value >= -0x8000:
+                append(INT16.pack(0xd1, value))
+            elif value >= -0x80000000:
+                append(INT32.pack(0xd2, value))
+            else:
+                append(INT64.pack(0xd3, value))
+        elif isinstance(value, float):
+            append(FLOAT64.pack(0xcb, value))
+        elif isinstance(value, str):
+            encoded = value.encode('utf-8')
+            length = len(encoded)
+            if length < 32:
+                append(bytes((0xa0 | length,)))
+            elif length <= 0xFF:
+                append(bytes((0xd9, length)))
+            else:
+                _header(parts, length, 0xa0, 0, 0xda, 0xdb)
+            append(encoded)
+        elif isinstance(value, dict):
+            _header(parts, len(value), 0x80, 16, 0xde, 0xdf)
+            for key, item in value.items():
+                pack(key)
+                pack(item)
+        elif isinstance(value, (list, tuple)):
+            _header(parts, len(value), 0x90, 16, 0xdc, 0xdd)
+            for item in value:
+                pack(item)
+        elif isinstance(value, (bytes, bytearray)):
+            length = len(value)
+            if length <= 0xFF:
+                append(bytes((0xc4, length)))
+            else:
+                _header(parts, length, 0, 0, 0xc5, 0xc6)
+            append(bytes(value))
+        else:
+            raise TypeError(f"Cannot serialize {type(value).__name__} as MessagePack")
+
+    pack(data)
+    return b''.join(parts)
+
+
+def pure_unpackb(payload):
+    # Pure-Python MessagePack decoder for the types pure_packb() writes.
+    view = memoryview(payload)
+    position = 0
+
+    def read(fmt, size):
+        nonlocal position
+        value = struct.unpack_from(fmt, view, position)[0]
+        position += size
+        return value
+
+    def take(length):
+        nonlocal position
+        chunk = view[position:position + length]
+        position += length
+        return chunk
+
+    def unpack():
+        nonlocal position
+        code = view[position]
+        position += 1
+
+        if code < 0x80:
+            return code
+        if code >= 0xe0:
+            return code - 0x100
+        if code <= 0x8f:
+            return {unpack(): unpack() for _ in range(code & 0x0f)}
+        if code <= 0x9f:
+            return [unpack() for _ in range(code & 0x0f)]
+        if code <= 0xbf:
+            return str(take(code & 0x1f), 'utf-8')
+
+        if code == 0xc0:
+            return None
+        if code == 0xc2:
+            return False
+        if code == 0xc3:
+            return True
+        if code in (0xc4, 0xc5, 0xc6):
+            length = read(*{0xc4: ('>B', 1), 0xc5: ('>H', 2), 0xc6: ('>I', 4)}[code])
+            return bytes(take(length))
+        if code == 0xca:
+            return read('>f', 4)
+        if code == 0xcb:
+            return read('>d', 8)
+        if 0xcc <= code <= 0xd3:
+            fmt, size = (('>B', 1), ('>H', 2), ('>I', 4), ('>Q', 8),
+                         ('>b', 1), ('>h', 2), ('>i', 4), ('>q', 8))[code - 0xcc]
+            return read(fmt, size)
+        if code in (0xd9, 0xda, 0xdb):
+            length = read(*{0xd9: ('>B', 1), 0xda: ('>H', 2), 0xdb: ('>I', 4)}[code])
+            return str(take(length), 'utf-8')
+        if code in (0xdc, 0xdd):
+            length = read('>H', 2) if code == 0xdc else read('>I', 4)
+            return [unpack() for _ in range(length)]
+        if code in (0xde, 0xdf):
+            length = read('>H', 2) if code == 0xde else read('>I', 4)
+            return {unpack(): unpack() for _ in range(length)}
+        raise ValueError(f"Unsupported MessagePack type 0x{code:02x}")
+
+    data = unpack()
+    if position != len(view):
+        raise ValueError("Extra data after MessagePack value")
+    return data
@@ -0,0 +1,120 @@
+# ================ Product Queries ================
+
+# Fixed statements are module constants: a prepared cursor only skips re-preparing
+# when it is handed the very same string object again.
+SELECT_ALL_PRODUCTS = "SELECT id, name, description, price, stocks FROM products"
+SELECT_PRODUCT_BY_ID = "SELECT id, name, description, price, stocks FROM products WHERE id = %s"
+SEARCH_PRODUCTS_BY_NAME = "SELECT id, name, description, price, stocks FROM products WHERE LOWER(name) LIKE %s"
+INSERT_PRODUCT = "INSERT INTO products (name, description, price, stocks) VALUES (%s, %s, %s, %s)"
+DELETE_PRODUCT = "DELETE FROM products WHERE id = %s"
+
+# Columns that may be changed through update_product()
+UPDATABLE_FIELDS = ('name', 'description', 'price', 'stocks')
+
+
+def price_from_db(value):
+    # `price` is a single-precision FLOAT. The binary protocol used by prepared statements
+    # returns its exact float32 value (99.98999786376953), the text protocol the short one
+    # (99.99); keep the 7 significant digits FLOAT holds so both decode the same.
+    return float(f"{float(value):.7g}")
+
+
+def row_to_product(row):
+    # Convert a products table row into a product dictionary.
+    return {
+        'id': row[0],
+        'name': row[1],
+        'description': row[2],
+        'price': price_from_db(row[3]),
+        'stocks': row[4]
+    }
+
+
+def fetch_all_products(connection):
+    # Return every product.
+    cursor = connection.statement_cursor(SELECT_ALL_PRODUCTS)
+    cursor.execute(SELECT_ALL_PRODUCTS)
+    return [row_to_product(row) for row in cursor.fetchall()]
+
+
+def fetch_product(connection, id):
+    # Return a single product by ID, or None if it does not exist.
+    cursor = connection.statement_cursor(SELECT_PRODUCT_BY_ID)
+    cursor.execute(SELECT_PRODUCT_BY_ID, (id,))
+    row = cursor.fetchone()
+    return row_to_product(row) if row is not None else None
+
+
+def fetch_products_by_ids(connection, ids):
+    # Return {id: product} for the given IDs that exist, using a single IN query.
+    if not ids:
+        return {}
+
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor = connection.cursor()
+    cursor.execute(f"{SELECT_ALL_PRODUCTS} WHERE id IN ({placeholders})", tuple(ids))
+    products = {row[0]: row_to_product(row) for row in cursor.fetchall()}
+    cursor.close()
+    return products
+
+
+def search_products_by_name(connection, name):
+    # Return products whose name contains the given text, case-insensitive.
+    cursor = connection.statement_cursor(SEARCH_PRODUCTS_BY_NAME)
+    cursor.execute(SEARCH_PRODUCTS_BY_NAME, (f"%{name.lower()}%",))
+    return [row_to_product(row) for row in cursor.fetchall()]
+
+
+def insert_product(connection, name, description, price, stocks):
+    # Insert a product and return its new ID.
+    cursor = connection.statement_cursor(INSERT_PRODUCT)
+    cursor.execute(INSERT_PRODUCT, (name, description, price, stocks))
+    connection.commit()
+    return cursor.lastrowid
+
+
+def update_product_fields(connection, id, fields):
+    # Update the given columns of a product. The statement depends on which
+    # fields are present, so it is sent as plain text rather than prepared.
+    columns = [column for column in UPDATABLE_FIELDS if column in fields]
+    values = [fields[column] for column in columns]
+    values.append(id)
+
+    cursor = connection.cursor()
+    cursor.execute(
+        f"UPDATE products SET {', '.join(f'{column} = %s' for column in columns)} WHERE id = %s",
+        tuple(values)
+    )
+    connection.commit()
+    cursor.close()
+
+
+def update_products_batch(connection, updates):
+    # Apply {id: {column: value}} updates in a single transaction. Ids that change the
+    # same set of columns share one statement executed with executemany().
+    groups = {}
+    for id, fields in updates.items():
+        columns = tuple(column for column in UPDATABLE_FIELDS if column in fields)
+        if columns:
+            groups.setdefault(columns, []).append(tuple(fields[column] for column in columns) + (id,))
+
+    cursor = connection.cursor()
+    try:
+        for columns, rows in groups.items():
+            cursor.executemany(
+                f"UPDATE products SET {', '.join(f'{column} = %s' for column in columns)} WHERE id = %s",
+                rows
+            )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def delete_product_by_id(connection, id):
+    # Delete a product by ID.
+    cursor = connection.statement_cursor(DELETE_PRODUCT)
+    cursor.execute(DELETE_PRODUCT, (id,))
+    connection.commit()
@@ -0,0 +1,230 @@
+import heapq
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+# ================ Full-Text Search Index ================
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+# A name match counts as this many description matches
+NAME_WEIGHT = 2
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Score multipliers for terms that only match a query token by prefix or with a typo
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+
+# Prefix lookups scan at most MAX_PREFIX_SCAN terms and keep the MAX_EXPANSIONS most common
+MAX_PREFIX_SCAN = 1000
+MAX_EXPANSIONS = 50
+
+# Tokens shorter than this are only matched exactly or by prefix
+FUZZY_MIN_LENGTH = 4
+
+
+def tokenize(text):
+    # Split text into lowercase alphanumeric tokens ("4K-ready" -> ["4k", "ready"]).
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+def deletes(term):
+    # Every string obtained by removing one character from the term.
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def within_one_edit(a, b):
+    # True if a and b differ by at most one insertion, deletion, substitution or
+    # transposition of adjacent characters.
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+
+    if len(a) == len(b):
+        differences = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(differences) == 1:
+            return True
+        first, second = differences[0], differences[-1]
+        return (len(differences) == 2 and second == first + 1
+                and a[first] == b[second] and a[second] == b[first])
+
+    shorter, longer = (a, b) if len(a) < len(b) else (b, a)
+    i = 0
+    while i < len(shorter) and shorter[i] == longer[i]:
+        i += 1
+    return shorter[i:] == longer[i + 1:]
+
+
+class SearchIndex:
+    # Inverted index over product name + description with BM25 ranking.
+    #
+    # Products are added, replaced and removed one at a time, so the index can follow
+    # writes without a rebuild. A sorted vocabulary serves prefix lookups, and a map from
+    # one-character deletions to terms finds terms within one edit of a misspelled token.
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # term -> {product id: weighted term frequency}
+        self._postings = {}
+        # product id -> {term: weighted term frequency}
+        self._documents = {}
+        # product id -> document length (sum of its weighted term frequencies)
+        self._lengths = {}
+        self._total_length = 0
+        self._vocabulary = []
+        # one-character deletion of a term -> terms it came from
+        self._deletes = {}
+        self._bulk_loading = False
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def from_products(cls, products):
+        # Build an index from product dictionaries. The vocabulary is sorted once at the
+        # end instead of inserting every new term into the sorted list.
+        index = cls()
+        index._bulk_loading = True
+        for product in products:
+            index.add(product)
+        index._bulk_loading = False
+
+        for term in sorted(index._postings):
+            index._add_term(term)
+        return index
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, product):
+        # Index a product, replacing any previous version of it.
+        frequencies = {}
+        for token in tokenize(product.get('name')):
+            frequencies[token] = frequencies.get(token, 0) + NAME_WEIGHT
+        for token in tokenize(product.get('description')):
+            frequencies[token] = frequencies.get(token, 0) + 1
+
+        id = product['id']
+        with self._lock:
+            self._remove(id)
+            self._documents[id] = frequencies
+            self._lengths[id] = sum(frequencies.values())
+            self._total_length += self._lengths[id]
+            for term, frequency in frequencies.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    self._add_term(term)
+                postings[id] = frequency
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def apply(self, upserts=(), deletes=()):
+        # Apply committed writes in place and return the index.
+        for product in upserts:
+            self.add(product)
+        for id in deletes:
+            self.remove(id)
+        return self
+
+    def _remove(self, id):
+        frequencies = self._documents.pop(id, None)
+        if frequencies is None:
+            return
+
+        self._total_length -= self._lengths.pop(id)
+        for term in frequencies:
+            postings = self._postings[term]
+            del postings[id]
+            if not postings:
+                del self._postings[term]
+                self._drop_term(term)
+
+    def _add_term(self, term):
+        if self._bulk_loading:
+            return
+        insort(self._vocabulary, term)
+        if len(term) >= FUZZY_MIN_LENGTH:
+            for deletion in deletes(term):
+                self._deletes.setdefault(deletion, set()).add(term)
+
+    def _drop_term(self, term):
+        position = bisect_left(self._vocabulary, term)
+        del self._vocabulary[position]
+        if len(term) >= FUZZY_MIN_LENGTH:
+            for deletion in deletes(term):
+                terms = self._deletes[deletion]
+                terms.discard(term)
+                if not terms:
+                    del self._deletes[deletion]
+
+    def _expand(self, token, prefix, fuzzy):
+        # Return {term: weight} for the index terms a query token matches.
+        expansions = {}
+        if token in self._postings:
+            expansions[token] = 1.0
+
+        if prefix:
+            candidates = []
+            position = bisect_left(self._vocabulary, token)
+            for term in self._vocabulary[position:position + MAX_PREFIX_SCAN]:
+                if not term.startswith(token):
+                    break
+                if term != token:
+                    candidates.append(term)
+            for term in heapq.nlargest(MAX_EXPANSIONS, candidates, key=lambda term: len(self._postings[term])):
+                expansions.setdefault(term, PREFIX_WEIGHT)
+
+        if fuzzy and len(token) >= FUZZY_MIN_LENGTH:
+            candidates = set(self._deletes.get(token, ()))
+            for deletion in deletes(token):
+                if deletion in self._postings:
+                    candidates.add(deletion)
+                candidates.update(self._deletes.get(deletion, ()))
+            for term in candidates:
+                if term not in expansions and within_one_edit(token, term):
+                    expansions[term] = FUZZY_WEIGHT
+
+        return expansions
+
+    def search(self, query, limit=20, prefix=False, fuzzy=False):
+        # Return up to `limit` (product id, score) pairs, best match first.
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        with self._lock:
+            document_count = len(self._documents)
+            # No indexed terms at all (e.g. every name is punctuation): nothing can match
+            if document_count == 0 or self._total_length == 0:
+                return []
+            average_length = self._total_length / document_count
+
+            # BM25 term score: factor * tf / (tf + base + slope * document length)
+            base = BM25_K1 * (1 - BM25_B)
+            slope = BM25_K1 * BM25_B / average_length
+            lengths = self._lengths
+
+            scores = {}
+            for token in tokens:
+                # A document scores once per query token, through its best-matching term
+                token_scores = {}
+                for term, weight in self._expand(token, prefix, fuzzy).items():
+                    postings = self._postings[term]
+                    frequency_count = len(postings)
+                    idf = math.log(1 + (document_count - frequency_count + 0.5) / (frequency_count + 0.5))
+                    factor = weight * idf * (BM25_K1 + 1)
+                    for id, frequency in postings.items():
+                        score = factor * frequency / (frequency + base + slope * lengths[id])
+                        if score > token_scores.get(id, 0.0):
+                            token_scores[id] = score
+                for id, score in token_scores.items():
+                    scores[id] = scores.get(id, 0.0) + score
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
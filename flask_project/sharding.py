@@ -0,0 +1,229 @@
+import heapq
+import itertools
+
+from breaker import CircuitOpen
+from products import (SELECT_ALL_PRODUCTS, SELECT_PRODUCT_BY_ID, SEARCH_PRODUCTS_BY_NAME, DELETE_PRODUCT,
+                      UPDATABLE_FIELDS, row_to_product)
+
+# ================ Sharded Product Storage ================
+
+# Ids are chosen by the store, so inserts name the id column explicitly
+INSERT_SHARDED_PRODUCT = "INSERT INTO products (id, name, description, price, stocks) VALUES (%s, %s, %s, %s, %s)"
+# Each shard has a one-column AUTO_INCREMENT table used as its id sequence
+NEXT_SEQUENCE_VALUE = "INSERT INTO product_id_sequence (seq) VALUES (NULL)"
+
+SHARD_STRATEGIES = ('hash', 'range')
+
+
+class ShardError(Exception):
+    # Raised when a statement on one of the shards fails.
+    def __init__(self, shard, error):
+        super().__init__(f"Shard {shard}: {error}")
+        self.shard = shard
+
+
+class Shard:
+    # One database holding part of the products table. `connect` returns a new DB-API
+    # connection; statements are written with %s placeholders and converted if the
+    # driver uses another style.
+
+    def __init__(self, name, connect, placeholder='%s', breaker=None):
+        self.name = name
+        self._connect = connect
+        self.placeholder = placeholder
+        # Circuit breaker guarding the shard's database, if any
+        self.breaker = breaker
+
+    @classmethod
+    def mysql(cls, database, name):
+        # A shard backed by a pooled MySQL database (db.Database).
+        return cls(name, lambda: database.connect(route=name), breaker=database.breaker)
+
+    @classmethod
+    def sqlite(cls, path, name=None):
+        # A shard backed by a SQLite file, used as a local stand-in for MySQL.
+        import sqlite3
+        return cls(name or path, lambda: sqlite3.connect(path), placeholder='?')
+
+    def _sql(self, statement):
+        return statement if self.placeholder == '%s' else statement.replace('%s', self.placeholder)
+
+    def query(self, statement, params=()):
+        # Run a SELECT and return the rows as product dictionaries.
+        connection = self._connect()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(self._sql(statement), tuple(params))
+            rows = cursor.fetchall()
+            cursor.close()
+            # With autocommit off the SELECT opened a transaction; end it so the pooled
+            # connection does not keep serving this snapshot to the next query
+            connection.rollback()
+        finally:
+            connection.close()
+        return [row_to_product(row) for row in rows]
+
+    def transaction(self, work):
+        # Call work(execute) inside one transaction and return its result;
+        # execute(statement, params) runs a statement and returns the cursor.
+        connection = self._connect()
+        cursor = connection.cursor()
+
+        def execute(statement, params=()):
+            cursor.execute(self._sql(statement), tuple(params))
+            return cursor
+
+        try:
+            result = work(execute)
+            connection.commit()
+            return result
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+            connection.close()
+
+
+def update_statement(columns):
+    return f"UPDATE products SET {', '.join(f'{column} = %s' for column in columns)} WHERE id = %s"
+
+
+class ShardedProductStore:
+    # The products table split across several databases by product id.
+    #
+    # - hash: a product lives on shard `id % N`. New ids are `sequence * N + shard`, taken
+    #   from the sequence of the shard the product goes to.
+    # - range: shard i holds ids i*range_size+1 .. (i+1)*range_size. New ids are
+    #   `i*range_size + sequence`.
+    #
+    # New products are spread round-robin over the shards. Queries that cannot be routed by
+    # id run on every shard in parallel and the results are merged in id order. The worker
+    # pool is shared by all requests; max_workers defaults to one per shard.
+
+    def __init__(self, shards, strategy='hash', range_size=None, max_workers=None):
+        if strategy not in SHARD_STRATEGIES:
+            raise ValueError(f"Unknown shard strategy {strategy!r}")
+        if strategy == 'range' and not range_size:
+            raise ValueError("Range sharding needs a range_size")
+
+        # Imported here so that apps without shards do not pay for it at startup
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.shards = list(shards)
+        self.strategy = strategy
+        self.range_size = range_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(self.shards), thread_name_prefix='shard')
+        self._next_shard = itertools.count()
+
+    def shard_index(self, id):
+        # Return the index of the shard holding the id, or None if no shard can hold it.
+        if self.strategy == 'hash':
+            return id % len(self.shards)
+        index = (id - 1) // self.range_size
+        return index if 0 <= index < len(self.shards) else None
+
+    def _allocate_id(self, index, sequence_value):
+        if self.strategy == 'hash':
+            return sequence_value * len(self.shards) + index
+        if sequence_value > self.range_size:
+            raise ShardError(self.shards[index].name, "id range exhausted")
+        return index * self.range_size + sequence_value
+
+    def _on_shard(self, shard, work):
+        # Run work(shard) on one shard, reporting failures as ShardError.
+        try:
+            return work(shard)
+        except (ShardError, CircuitOpen):
+            raise
+        except Exception as e:
+            raise ShardError(shard.name, e) from e
+
+    def _fan_out(self, work, shards=None):
+        # Run work(shard) on several shards in parallel; results come back in shard order.
+        shards = self.shards if shards is None else list(shards)
+        futures = [self._executor.submit(self._on_shard, shard, work) for shard in shards]
+        return [future.result() for future in futures]
+
+    def _merged(self, statement, params=()):
+        results = self._fan_out(lambda shard: shard.query(statement + " ORDER BY id", params))
+        return list(heapq.merge(*results, key=lambda product: product['id']))
+
+    def fetch_all(self):
+        # Return every product, ordered by id.
+        return self._merged(SELECT_ALL_PRODUCTS)
+
+    def search(self, name):
+        # Return products whose name contains the given text, case-insensitive, ordered by id.
+        return self._merged(SEARCH_PRODUCTS_BY_NAME, (f"%{name.lower()}%",))
+
+    def fetch(self, id):
+        # Return a single product by ID, or None if it does not exist.
+        index = self.shard_index(id)
+        if index is None:
+            return None
+        rows = self._on_shard(self.shards[index], lambda shard: shard.query(SELECT_PRODUCT_BY_ID, (id,)))
+        return rows[0] if rows else None
+
+    def fetch_many(self, ids):
+        # Return {id: product} for the given IDs that exist, one IN query per shard involved.
+        by_shard = {}
+        for id in ids:
+            index = self.shard_index(id)
+            if index is not None:
+                by_shard.setdefault(self.shards[index], []).append(id)
+        if not by_shard:
+            return {}
+
+        def fetch_shard(shard):
+            shard_ids = by_shard[shard]
+            placeholders = ', '.join(['%s'] * len(shard_ids))
+            return shard.query(f"{SELECT_ALL_PRODUCTS} WHERE id IN ({placeholders})", shard_ids)
+
+        found = {}
+        for products in self._fan_out(fetch_shard, by_shard):
+            for product in products:
+                found[product['id']] = product
+        return found
+
+    def insert(self, name, description, price, stocks):
+        # Insert a product on the next shard in turn and return its new, globally unique ID.
+        index = next(self._next_shard) % len(self.shards)
+
+        def insert_row(execute):
+            id = self._allocate_id(index, execute(NEXT_SEQUENCE_VALUE).lastrowid)
+            execute(INSERT_SHARDED_PRODUCT, (id, name, description, price, stocks))
+            return id
+
+        return self._on_shard(self.shards[index], lambda shard: shard.transaction(insert_row))
+
+    def update(self, id, fields):
+        # Update the given columns of a product.
+        self.update_many({id: fields})
+
+    def update_many(self, updates):
+        # Apply {id: {column: value}} updates, in one transaction per shard involved.
+        by_shard = {}
+        for id, fields in updates.items():
+            columns = tuple(column for column in UPDATABLE_FIELDS if column in fields)
+            index = self.shard_index(id)
+            if columns and index is not None:
+                by_shard.setdefault(self.shards[index], []).append((columns, tuple(fields[column] for column in columns) + (id,)))
+
+        def update_shard(shard):
+            def update_rows(execute):
+                for columns, values in by_shard[shard]:
+                    execute(update_statement(columns), values)
+            shard.transaction(update_rows)
+
+        self._fan_out(update_shard, by_shard)
+
+    def delete(self, id):
+        # Delete a product by ID.
+        index = self.shard_index(id)
+        if index is not None:
+            self._on_shard(self.shards[index], lambda shard: shard.transaction(lambda execute: execute(DELETE_PRODUCT, (id,))))
+
+    def close(self):
+        # Stop the fan-out workers.
+        self._executor.shutdown(wait=False)
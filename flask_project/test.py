@@ -2,14 +2,27 @@
 
 import pytest
 import json
-from app import app
+import os
+import subprocess
+import sys
+import threading
+from app import create_app
+from db import QueryStats, TracedConnection, PreparedStatementCache, driver_config, fingerprint, is_row_error
+from products import SELECT_PRODUCT_BY_ID, price_from_db
+from auth import CredentialStore, hash_password
+from catalog import Catalog, CatalogSnapshot
+from breaker import CircuitBreaker, CircuitOpen
+from writeback import JournalLocked, QueueFull, WriteBehindQueue
+from search_index import SearchIndex
+from sharding import Shard, ShardedProductStore
+from msgpack_codec import pure_packb, pure_unpackb, unpackb
 
 # ============= TEST CONFIGURATION =============
 
 @pytest.fixture
 def client():
     # Create test client for Flask application.
-    app.config['TESTING'] = True
+    app = create_app({'TESTING': True})
     with app.test_client() as client:
         yield client
 
@@ -446,6 +459,731 @@ def test_format_consistency(client):
     xml_response = client.get('/api/products/search?name=keyboard&format=xml')
     assert 'application/xml' in xml_response.content_type
 
+
+# ============= TEST 10: QUERY TRACING =============
+
+class FakeCursor:
+    # Minimal DB-API cursor standing in for mysql.connector in unit tests.
+    def __init__(self, rowcount, prepared=False):
+        self.rowcount = rowcount
+        self.prepared = prepared
+        self.with_rows = False
+        self.executed = []
+
+    def execute(self, operation, params=None):
+        self.executed.append(operation)
+        self.with_rows = operation.lstrip().upper().startswith('SELECT')
+
+    def fetchall(self):
+        return [(i, 'Product', None, 1.5, 10) for i in range(self.rowcount)]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rowcount=3, connection_id=1):
+        self.rowcount = rowcount
+        self.connection_id = connection_id
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self.rowcount, prepared=kwargs.get('prepared', False))
+
+
+def test_query_tracing():
+    # Literals and placeholders collapse into one fingerprint
+    assert fingerprint("SELECT * FROM products WHERE id = %s") == \
+        fingerprint("SELECT *  FROM products\nWHERE id = 42")
+    assert fingerprint("SELECT * FROM products WHERE id IN (%s, %s, %s)") == \
+        "select * from products where id in (...)"
+    assert fingerprint("SELECT * FROM products WHERE LOWER(name) LIKE 'key%'") == \
+        "select * from products where lower(name) like ?"
+
+    # Every statement is aggregated under its fingerprint
+    stats = QueryStats()
+    connection = TracedConnection(FakeConnection(rowcount=3), stats, slow_threshold_ms=0)
+    cursor = connection.cursor()
+    cursor.execute("SELECT * FROM products WHERE id = %s", (1,))
+    cursor.execute("SELECT * FROM products WHERE id = %s", (2,))
+    cursor.close()
+
+    entries = stats.snapshot()
+    assert len(entries) == 1
+    assert entries[0]['calls'] == 2
+    assert entries[0]['params_count'] == 1
+    assert entries[0]['rows_returned'] == 6
+    assert entries[0]['slow_calls'] == 2
+
+    stats.reset()
+    assert stats.snapshot() == []
+
+
+# ============= TEST 11: PREPARED STATEMENT REUSE =============
+
+def test_prepared_statement_reuse():
+    cache = PreparedStatementCache(max_connections=2)
+    first = FakeConnection(connection_id=1)
+    second = FakeConnection(connection_id=2)
+
+    # One prepared cursor per statement and physical connection
+    cursor = cache.get(first, SELECT_PRODUCT_BY_ID)
+    assert cursor.prepared
+    assert cache.get(first, SELECT_PRODUCT_BY_ID) is cursor
+    assert cache.get(second, SELECT_PRODUCT_BY_ID) is not cursor
+
+    # Connections beyond the limit evict the least recently used one
+    cache.get(FakeConnection(connection_id=3), SELECT_PRODUCT_BY_ID)
+    assert cache.get(first, SELECT_PRODUCT_BY_ID) is not cursor
+
+    # Rows from prepared cursors are buffered and traced like any other statement
+    stats = QueryStats()
+    connection = TracedConnection(FakeConnection(rowcount=2, connection_id=4), stats, prepared_cache=cache)
+    traced = connection.statement_cursor(SELECT_PRODUCT_BY_ID)
+    traced.execute(SELECT_PRODUCT_BY_ID, (1,))
+    assert traced.fetchone()[0] == 0
+    assert traced.fetchone()[0] == 1
+    assert traced.fetchone() is None
+    assert stats.snapshot()[0]['calls'] == 1
+
+    # FLOAT prices decode the same over the binary and text protocols
+    assert price_from_db(99.98999786376953) == 99.99
+    assert price_from_db(29.99) == 29.99
+
+
+# ============= TEST 12: LAZY APP FACTORY =============
+
+def test_lazy_app_factory():
+    # Building the app must not import the DB driver, JWT or the XML encoder
+    code = (
+        "import sys, app; app.create_app(); "
+        "print(','.join(m for m in ('mysql.connector', 'jwt', 'xml.etree.ElementTree') if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.stdout.strip() == ''
+
+    # Configuration comes from the environment, with explicit overrides on top
+    app = create_app({'DB_POOL_SIZE': 2})
+    assert app.config['DB_POOL_SIZE'] == 2
+    assert app.config['DB_CONFIG']['database'] == 'flask_api_db'
+
+
+# ============= TEST 13: CREDENTIALS & REFRESH TOKENS =============
+
+def test_credentials_and_refresh_tokens(client):
+    # Passwords are stored salted and hashed
+    store = CredentialStore({'alice': hash_password('secret')})
+    assert hash_password('secret') != hash_password('secret')
+    assert store.verify('alice', 'secret')
+    assert store.verify('alice', 'secret')  # served from the verified cache
+    assert not store.verify('alice', 'wrong')
+    assert not store.verify('bob', 'secret')
+
+    # Changing a password invalidates the cached verification
+    store.set_password('alice', 'new-secret')
+    assert not store.verify('alice', 'secret')
+    assert store.verify('alice', 'new-secret')
+
+    # Login returns a refresh token that can be exchanged for a new access token
+    response = client.post(
+        '/api/auth/login',
+        data=json.dumps({'username': 'admin', 'password': 'admin123'}),
+        content_type='application/json'
+    )
+    tokens = json.loads(response.data)
+    assert 'refresh_token' in tokens
+
+    response = client.post(
+        '/api/auth/refresh',
+        data=json.dumps({'refresh_token': tokens['refresh_token']}),
+        content_type='application/json'
+    )
+    assert response.status_code == 200
+    assert 'token' in json.loads(response.data)
+
+    # Access and refresh tokens are not interchangeable
+    response = client.post(
+        '/api/auth/refresh',
+        data=json.dumps({'refresh_token': tokens['token']}),
+        content_type='application/json'
+    )
+    assert response.status_code == 401
+
+    response = client.delete('/api/products/1', headers={'Authorization': f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 401
+
+
+# ============= TEST 14: IN-MEMORY CATALOG SNAPSHOT =============
+
+SAMPLE_PRODUCTS = [
+    {'id': 1, 'name': 'Wireless Keyboard', 'description': 'Ergonomic keyboard', 'price': 29.99, 'stocks': 45},
+    {'id': 2, 'name': 'Wireless Mouse', 'description': None, 'price': 19.99, 'stocks': None},
+    {'id': 3, 'name': 'USB Hub', 'description': '4 ports', 'price': 14.5, 'stocks': 0}
+]
+
+
+def test_catalog_snapshot():
+    catalog = Catalog(lambda: SAMPLE_PRODUCTS, reload_seconds=3600)
+    app = create_app({'TESTING': True, 'CATALOG_SNAPSHOT': True})
+    app.extensions['catalog'] = catalog
+    client = app.test_client()
+
+    # Reads are served from memory (no database is available here)
+    response = client.get('/api/products')
+    assert response.status_code == 200
+    assert json.loads(response.data) == SAMPLE_PRODUCTS
+
+    response = client.get('/api/products/2?format=xml')
+    assert response.status_code == 200
+    assert b'<name>Wireless Mouse</name>' in response.data
+
+    assert client.get('/api/products/99').status_code == 404
+
+    response = client.get('/api/products/search?name=WIRELESS')
+    assert [p['id'] for p in json.loads(response.data)] == [1, 2]
+
+    # Writes produce a new snapshot; snapshots already handed out do not change
+    before = catalog.snapshot()
+    catalog.upsert({'id': 4, 'name': 'Webcam', 'description': None, 'price': 49.99, 'stocks': 5})
+    catalog.delete(1)
+    after = catalog.snapshot()
+    assert len(before) == 3 and before.get(1) is not None
+    assert [p['id'] for p in after.all()] == [2, 3, 4]
+
+    # Patching matches a full rebuild: mid-table inserts, replacements and deletes
+    patched = after.apply(upserts=[{'id': 1, 'name': 'Keyboard', 'description': None, 'price': 9.5, 'stocks': None},
+                                   {'id': 3, 'name': 'USB-C Hub', 'description': '7 ports', 'price': 20.0, 'stocks': 2}],
+                          deletes=[2])
+    rebuilt = CatalogSnapshot.from_products(patched.all())
+    assert patched.all() == rebuilt.all() and patched.index == rebuilt.index
+    assert [p['id'] for p in patched.search('usb-c')] == [3]
+    assert after.get(3)['name'] == 'USB Hub'
+
+    # A snapshot older than the staleness bound is not served
+    catalog.max_staleness_seconds = -1
+    assert catalog.snapshot() is None
+    catalog.stop()
+
+
+# ============= TEST 15: WRITE-BEHIND QUEUE =============
+
+def test_write_behind_queue(tmp_path):
+    journal = str(tmp_path / 'write_behind.journal')
+    batches = []
+
+    def failing_flush(updates):
+        raise RuntimeError("database is down")
+
+    # Updates to one id are coalesced field by field, last writer wins
+    queue = WriteBehindQueue(failing_flush, journal, max_batch=100, flush_seconds=3600,
+                             max_pending=2, enqueue_timeout=0)
+    queue.enqueue(1, {'price': 10.0})
+    queue.enqueue(1, {'price': 12.5, 'stocks': 3})
+    queue.enqueue(2, {'stocks': 7})
+    assert queue.pending_count() == 2
+
+    # A full queue pushes back on new ids but still accepts updates to queued ones
+    with pytest.raises(QueueFull):
+        queue.enqueue(3, {'stocks': 1})
+    queue.enqueue(2, {'stocks': 8})
+
+    # Failed batches stay queued and journaled, even across a restart
+    assert queue.flush() is False
+    queue.close()
+
+    queue = WriteBehindQueue(batches.append, journal, flush_seconds=3600)
+    assert queue.pending_count() == 2
+    queue.close()  # flushes on shutdown
+    assert batches == [{1: {'price': 12.5, 'stocks': 3}, 2: {'stocks': 8}}]
+
+    # The journal only keeps what has not been written yet
+    queue = WriteBehindQueue(batches.append, journal, flush_seconds=3600)
+    assert queue.pending_count() == 0
+    queue.close()
+
+    # One bad row is set aside instead of blocking the rest of its batch; errors that are not
+    # about the row (here the circuit opening halfway) keep the remaining updates queued
+    from mysql.connector import errors
+    written = {}
+
+    def picky_flush(updates):
+        if list(updates) == [4]:
+            raise CircuitOpen(15)
+        if 2 in updates:
+            raise errors.DataError("Out of range value for column 'price' at row 1", errno=1264)
+        written.update(updates)
+
+    queue = WriteBehindQueue(picky_flush, journal, flush_seconds=3600, is_row_error=is_row_error)
+    for id in range(1, 6):
+        queue.enqueue(id, {'price': 1e39} if id == 2 else {'stocks': id})
+    assert queue.flush() is False
+    assert written == {1: {'stocks': 1}, 3: {'stocks': 3}}
+    assert queue.stats['dead_lettered'] == 1
+    assert [entry['id'] for entry in queue.dead_letters] == [2]
+    assert queue.pending_count() == 2
+    assert queue.flush() is True
+    assert set(written) == {1, 3, 4, 5}
+    queue.close()
+    with open(journal + '.dead', encoding='utf-8') as dead_letters:
+        assert json.loads(dead_letters.readline())['fields'] == {'price': 1e39}
+
+    # Updates for a shard that is down are kept, not mistaken for bad rows
+    healthy = sqlite_shards(tmp_path / 'healthy', 1)[0]
+    down = Shard.sqlite(str(tmp_path / 'missing' / 'shard1.db'), name='shard1')
+    store = ShardedProductStore([healthy, down])
+    queue = WriteBehindQueue(store.update_many, journal, flush_seconds=3600, is_row_error=is_row_error)
+    for id in range(2, 6):
+        queue.enqueue(id, {'stocks': id})
+    assert queue.flush() is False
+    assert queue.pending_count() == 4
+    assert queue.stats['dead_lettered'] == 0
+    queue.close()
+    store.close()
+    os.remove(journal)
+
+    # When every update fails the database is down: nothing is dropped
+    queue = WriteBehindQueue(failing_flush, journal, flush_seconds=3600, is_row_error=is_row_error)
+    assert queue.pending_count() == 0
+    queue.enqueue(1, {'stocks': 5})
+    queue.enqueue(2, {'stocks': 9})
+    assert queue.flush() is False
+    assert queue.pending_count() == 2
+    assert queue.stats['dead_lettered'] == 0
+
+    # A second process (or queue) cannot share the journal while it is in use...
+    with pytest.raises(JournalLocked):
+        WriteBehindQueue(batches.append, journal, flush_seconds=3600)
+
+    # ...so every worker claims the first free slot, and a restarted worker replays its slot
+    second = WriteBehindQueue.in_free_slot(batches.append, journal, flush_seconds=3600)
+    assert second.journal_path == str(tmp_path / 'write_behind.1.journal')
+    queue.close()
+    restarted = WriteBehindQueue.in_free_slot(batches.append, journal, flush_seconds=3600)
+    assert restarted.journal_path == journal
+    assert restarted.pending_count() == 2
+    restarted.close()
+    second.close()
+
+
+# ============= TEST 16: BATCH GET BY IDS =============
+
+def test_batch_get_by_ids():
+    app = create_app({'TESTING': True, 'CATALOG_SNAPSHOT': True, 'MAX_BATCH_IDS': 5})
+    app.extensions['catalog'] = Catalog(lambda: SAMPLE_PRODUCTS, reload_seconds=3600)
+    client = app.test_client()
+
+    # Products come back in request order, with unknown ids reported
+    response = client.get('/api/products?ids=3,1,99,3')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [p['id'] for p in data['products']] == [3, 1, 3]
+    assert data['missing'] == [99]
+
+    response = client.get('/api/products?ids=2,99&format=xml')
+    assert response.status_code == 200
+    assert b'<products><item><id>2</id>' in response.data
+    assert b'<missing><item>99</item></missing>' in response.data
+
+    # Invalid, empty and oversized id lists are rejected
+    assert client.get('/api/products?ids=1,abc').status_code == 400
+    assert client.get('/api/products?ids=').status_code == 400
+    assert client.get('/api/products?ids=1,2,3,4,5,6').status_code == 400
+    app.extensions['catalog'].stop()
+
+
+# ============= TEST 17: FULL-TEXT SEARCH =============
+
+def test_full_text_search():
+    index = SearchIndex.from_products(SAMPLE_PRODUCTS)
+
+    # Terms match in name and description; name matches rank higher
+    assert [id for id, score in index.search('ergonomic')] == [1]
+    assert [id for id, score in index.search('keyboard')] == [1]
+    assert {id for id, score in index.search('wireless')} == {1, 2}
+    assert [id for id, score in index.search('4 ports')] == [3]
+
+    # Prefix matching and typo tolerance are opt-in
+    assert index.search('keyb') == []
+    assert [id for id, score in index.search('keyb', prefix=True)] == [1]
+    assert [id for id, score in index.search('wireles mose', fuzzy=True)][0] == 2
+
+    # The index follows writes without a rebuild
+    index.apply(upserts=[{'id': 5, 'name': '4K Monitor', 'description': 'Ultra HD display', 'price': 199.0}])
+    index.apply(deletes=[1])
+    assert [id for id, score in index.search('4K')] == [5]
+    assert index.search('ergonomic') == []
+
+    # Products without any indexable term do not break scoring
+    punctuation_only = SearchIndex.from_products([{'id': 1, 'name': '---', 'description': None, 'price': 1.0}])
+    assert punctuation_only.search('keyboard') == []
+
+    # Searches arriving during the first build wait for it instead of finding no index
+    loading, release = threading.Event(), threading.Event()
+
+    def slow_loader():
+        loading.set()
+        release.wait(5)
+        return SAMPLE_PRODUCTS
+
+    building = Catalog(slow_loader, reload_seconds=3600, max_staleness_seconds=float('inf'),
+                       build=SearchIndex.from_products)
+    results = []
+    searches = [threading.Thread(target=lambda: results.append(building.snapshot(wait=True))) for _ in range(2)]
+    searches[0].start()
+    loading.wait(5)
+    searches[1].start()
+    searches[1].join(0.05)
+    assert searches[1].is_alive()
+    release.set()
+    for search in searches:
+        search.join(5)
+    assert len(results) == 2 and None not in results
+    building.stop()
+
+    # Exposed through the search endpoint with the 'q' parameter
+    app = create_app({'TESTING': True, 'CATALOG_SNAPSHOT': True})
+    app.extensions['catalog'] = Catalog(lambda: SAMPLE_PRODUCTS, reload_seconds=3600)
+    app.extensions['search_index'] = Catalog(lambda: SAMPLE_PRODUCTS, reload_seconds=3600,
+                                             max_staleness_seconds=float('inf'),
+                                             build=SearchIndex.from_products)
+    client = app.test_client()
+
+    response = client.get('/api/products/search?q=ergonomic')
+    assert response.status_code == 200
+    results = json.loads(response.data)
+    assert [p['id'] for p in results] == [1]
+    assert results[0]['score'] > 0
+
+    response = client.get('/api/products/search?q=mous&prefix=1&format=xml')
+    assert b'<name>Wireless Mouse</name>' in response.data
+
+    assert client.get('/api/products/search?q=usb&limit=0').status_code == 400
+    app.extensions['catalog'].stop()
+    app.extensions['search_index'].stop()
+
+# ============= TEST 18: REQUEST-SCOPED DB SESSION =============
+
+class FakePooledConnection(FakeConnection):
+    # Pooled connection that records how it was handed back.
+    def __init__(self, pool, connection_id):
+        super().__init__(rowcount=1, connection_id=connection_id)
+        self.pool = pool
+        self.in_transaction = False
+        self.rolled_back = False
+        self.disconnected = False
+
+    def rollback(self):
+        self.rolled_back = True
+        self.in_transaction = False
+
+    def disconnect(self):
+        self.disconnected = True
+
+    def close(self):
+        self.pool.returned.append(self)
+
+
+class FakePool:
+    def __init__(self):
+        self.checked_out = 0
+        self.returned = []
+
+    def get_connection(self):
+        self.checked_out += 1
+        return FakePooledConnection(self, connection_id=100 + self.checked_out)
+
+
+def test_request_scoped_session():
+    app = create_app({'TESTING': True})
+    database = app.extensions['db']
+    pool = database._pool = FakePool()
+    client = app.test_client()
+
+    # A request reuses one connection, returned to the pool at teardown
+    response = client.get('/api/products/1')
+    assert response.status_code == 200
+    assert pool.checked_out == 1
+    assert len(pool.returned) == 1
+
+    # Timeouts are set once per physical connection
+    connection = pool.returned[0]
+    assert connection.connection_id in database._configured
+
+    # Connections never go back to the pool with a transaction (and its read view) still open
+    with app.app_context():
+        reader = database.connect()
+        reader._connection.in_transaction = True
+        reader.close()
+    assert reader._connection.rolled_back
+
+    # Connections a request never closes are reported as leaked and closed anyway;
+    # open transactions are rolled back and abandoned statements cancelled
+    killed = []
+    database.kill_query = killed.append
+    with app.test_request_context('/api/products'):
+        leaked = database.connect()
+        leaked.cursor().execute("UPDATE products SET stocks = 0 WHERE id = 1")
+        leaked._connection.in_transaction = True
+        abandoned = database.connect()
+        abandoned.statement_in_flight = True
+        reading = database.connect()
+        reading.cursor().execute(SELECT_PRODUCT_BY_ID, (1,))
+        reading._connection.in_transaction = True
+    assert leaked._connection.rolled_back
+    assert reading._connection.rolled_back
+    assert abandoned._connection.disconnected
+    assert killed == [abandoned.connection_id]
+    assert len(pool.returned) == 5
+
+    routes = {entry['route']: entry for entry in database.metrics.snapshot()}
+    assert routes['api.get_product']['checked_out'] == 1
+    assert routes['api.get_product']['open'] == 0
+    assert routes['api.get_product']['leaked'] == 0
+    # Only the transaction that wrote counts as rolled back, not the one opened by a read
+    assert routes['api.get_products']['leaked'] == 3
+    assert routes['api.get_products']['rolled_back'] == 1
+    assert routes['api.get_products']['cancelled'] == 1
+    assert routes['api.get_products']['max_open'] == 3
+    assert routes['api.get_products']['open'] == 0
+
+# ============= TEST 19: SHARDED PRODUCT STORAGE =============
+
+SHARD_SCHEMA = (
+    "CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT NOT NULL, description TEXT, "
+    "price REAL NOT NULL, stocks INTEGER)",
+    "CREATE TABLE product_id_sequence (seq INTEGER PRIMARY KEY AUTOINCREMENT)"
+)
+
+
+def sqlite_shards(directory, count):
+    # Create `count` empty SQLite databases standing in for MySQL shards.
+    import sqlite3
+    directory.mkdir(exist_ok=True)
+    shards = []
+    for index in range(count):
+        path = str(directory / f'shard{index}.db')
+        connection = sqlite3.connect(path)
+        for statement in SHARD_SCHEMA:
+            connection.execute(statement)
+        connection.close()
+        shards.append(Shard.sqlite(path, name=f'shard{index}'))
+    return shards
+
+
+class FifoSQLitePool:
+    # Hands out SQLite connections the way mysql-connector's pool does: in FIFO order, with
+    # autocommit off, so a SELECT opens a transaction that outlives the checkout.
+
+    def __init__(self, path, size):
+        import sqlite3
+        self._idle = []
+        for _ in range(size):
+            connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._idle.append(connection)
+
+    def connect(self):
+        pool, connection = self, self._idle.pop(0)
+
+        class PooledConnection:
+            def cursor(self):
+                if not connection.in_transaction:
+                    connection.execute("BEGIN")
+                return connection.cursor()
+
+            def commit(self):
+                connection.commit()
+
+            def rollback(self):
+                connection.rollback()
+
+            def close(self):
+                pool._idle.append(connection)
+
+        return PooledConnection()
+
+
+def test_sharded_product_storage(tmp_path, client, auth_token):
+    store = ShardedProductStore(sqlite_shards(tmp_path / 'hashed', 3), strategy='hash')
+    ids = [store.insert(f'Product {n}', None, 10.0 + n, n) for n in range(6)]
+
+    # Ids are unique across shards and each product lives on the shard its id routes to
+    assert len(set(ids)) == 6
+    assert {store.shard_index(id) for id in ids} == {0, 1, 2}
+    for shard in store.shards:
+        for product in shard.query("SELECT id, name, description, price, stocks FROM products"):
+            assert store.shards[store.shard_index(product['id'])] is shard
+
+    # Fan-out reads are merged in id order
+    assert [p['id'] for p in store.fetch_all()] == sorted(ids)
+    assert [p['id'] for p in store.search('PRODUCT 1')] == [ids[1]]
+    assert set(store.fetch_many(ids[:4] + [10 ** 6])) == set(ids[:4])
+
+    store.update_many({ids[0]: {'price': 99.5}, ids[1]: {'stocks': 0}})
+    assert store.fetch(ids[0])['price'] == 99.5
+    assert store.fetch(ids[1])['stocks'] == 0
+    store.delete(ids[0])
+    assert store.fetch(ids[0]) is None
+    store.close()
+
+    # Range sharding keeps consecutive ids together
+    ranged = ShardedProductStore(sqlite_shards(tmp_path / 'ranged', 2), strategy='range', range_size=10)
+    assert [ranged.insert('Cable', None, 1.0, 1) for n in range(4)] == [1, 11, 2, 12]
+    assert ranged.fetch(25) is None
+    ranged.close()
+
+    # A pooled connection that served a read does not keep reading its old snapshot
+    sqlite_shards(tmp_path / 'pooled', 1)
+    pool = FifoSQLitePool(str(tmp_path / 'pooled' / 'shard0.db'), 2)
+    pooled = ShardedProductStore([Shard('pooled', pool.connect, placeholder='?')])
+    id = pooled.insert('Desk Lamp', None, 20.0, 5)
+    assert pooled.fetch(id)['price'] == 20.0
+    pooled.update(id, {'price': 25.0})
+    assert pooled.fetch(id)['price'] == 25.0
+    pooled.close()
+
+    # The fan-out workers shared by all requests cover every pooled shard connection
+    app = create_app({'TESTING': True, 'DB_SHARDS': [{'database': 'shop0'}, {'database': 'shop1'}],
+                      'DB_POOL_SIZE': 4})
+    assert app.extensions['shards']._executor._max_workers == 8
+    app.extensions['shards'].close()
+
+    # Routes use the shards when they are configured
+    client.application.extensions['shards'] = ShardedProductStore(sqlite_shards(tmp_path / 'app', 2))
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    created = [
+        json.loads(client.post('/api/products', json={'name': name, 'price': 5.0, 'stocks': 1},
+                               headers=headers).data)['id']
+        for name in ('USB Cable', 'USB Hub', 'Monitor')
+    ]
+    response = client.get('/api/products')
+    assert [p['id'] for p in json.loads(response.data)] == sorted(created)
+    response = client.get('/api/products/search?name=usb')
+    assert [p['name'] for p in json.loads(response.data)] == ['USB Cable', 'USB Hub']
+
+    response = client.put(f'/api/products/{created[2]}', json={'price': 7.5}, headers=headers)
+    assert json.loads(response.data)['price'] == 7.5
+    assert client.delete(f'/api/products/{created[0]}', headers=headers).status_code == 200
+    assert client.get(f'/api/products/{created[0]}').status_code == 404
+    client.application.extensions['shards'].close()
+
+# ============= TEST 20: MESSAGEPACK RESPONSES =============
+
+def test_msgpack_responses():
+    # The pure-Python codec follows the MessagePack spec byte for byte
+    assert pure_packb({'id': 1, 'price': 1.5, 'stocks': None}) == \
+        b'\x83\xa2id\x01\xa5price\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00\xa6stocks\xc0'
+    values = [0, 127, 128, -1, -33, 65536, -2 ** 40, 2 ** 64 - 1, 'x' * 40, 'é' * 300,
+              list(range(20)), {str(n): n for n in range(20)}, True, False, b'raw']
+    assert pure_unpackb(pure_packb(values)) == values
+
+    app = create_app({'TESTING': True, 'CATALOG_SNAPSHOT': True})
+    app.extensions['catalog'] = Catalog(lambda: SAMPLE_PRODUCTS, reload_seconds=3600)
+    client = app.test_client()
+
+    # Selected with ?format=msgpack or through the Accept header
+    response = client.get('/api/products?format=msgpack')
+    assert response.mimetype == 'application/msgpack'
+    assert unpackb(response.data) == json.loads(client.get('/api/products').data)
+
+    response = client.get('/api/products/2', headers={'Accept': 'application/msgpack'})
+    assert unpackb(response.data)['name'] == 'Wireless Mouse'
+    assert client.get('/api/products/2', headers={'Accept': '*/*'}).mimetype == 'application/json'
+
+    # Caches are told the body depends on Accept unless the format is in the URL
+    assert 'Accept' in client.get('/api/products/2').vary
+    assert 'Accept' not in client.get('/api/products/2?format=json').vary
+    app.extensions['catalog'].stop()
+
+# ============= TEST 21: DATABASE CIRCUIT BREAKER =============
+
+class FailingPool:
+    # Connection pool of a database that does not answer.
+    def __init__(self, error=None):
+        self.attempts = 0
+        self.error = error
+
+    def get_connection(self):
+        from mysql.connector import errors
+        self.attempts += 1
+        raise self.error or errors.InterfaceError("Can't connect to MySQL server")
+
+
+def test_circuit_breaker(auth_token, monkeypatch):
+    now = [0.0]
+    breaker = CircuitBreaker(failure_rate=0.5, minimum_calls=4, window_seconds=10, open_seconds=5,
+                             clock=lambda: now[0])
+
+    # Opens once half of at least minimum_calls recent calls failed
+    for succeeded in (True, True, False):
+        breaker.before_call()
+        breaker.record(succeeded)
+    assert breaker.state == 'closed'
+    breaker.before_call()
+    breaker.record(False)
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+    # After open_seconds a single probe goes through; its outcome decides the state
+    now[0] += 5
+    breaker.before_call()
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+    breaker.record(False)
+    assert breaker.state == 'open'
+    now[0] += 5
+    breaker.before_call()
+    breaker.record(True)
+    assert breaker.state == 'closed'
+    assert breaker.snapshot()['transitions'] == {
+        'closed->open': 1, 'open->half_open': 2, 'half_open->open': 1, 'half_open->closed': 1}
+    assert breaker.snapshot()['rejected'] == 2
+
+    # With MySQL down the app stops connecting, serves the stale catalog and fails writes fast
+    app = create_app({'TESTING': True, 'CATALOG_SNAPSHOT': True,
+                      'CIRCUIT_BREAKER_CONFIG': {'minimum_calls': 2, 'open_seconds': 60}})
+    app.extensions['catalog'] = Catalog(lambda: SAMPLE_PRODUCTS, reload_seconds=3600, max_staleness_seconds=0)
+    pool = app.extensions['db']._pool = FailingPool()
+    app_client = app.test_client()
+
+    assert app_client.get('/api/products/1').status_code == 500
+    assert app_client.get('/api/products/1').status_code == 500
+    assert pool.attempts == 2
+
+    response = app_client.get('/api/products/1')
+    assert response.status_code == 200
+    assert json.loads(response.data)['name'] == 'Wireless Keyboard'
+
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    response = app_client.post('/api/products', json={'name': 'Cable', 'price': 2.0}, headers=headers)
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) > 0
+    assert pool.attempts == 2
+
+    state = json.loads(app_client.get('/api/admin/breaker', headers=headers).data)['database']
+    assert state['state'] == 'open'
+    assert state['transitions']['closed->open'] == 1
+    assert state['rejected'] == 1
+    app.extensions['catalog'].stop()
+
+    # An exhausted pool says nothing about MySQL; a pool the driver refuses to set up is a failure
+    from mysql.connector import errors
+    for message, state in (("Failed getting connection; pool exhausted", 'closed'),
+                           ("Connection configuration not valid: Unsupported argument 'read_timeout'", 'open')):
+        app = create_app({'TESTING': True, 'CIRCUIT_BREAKER_CONFIG': {'minimum_calls': 2, 'open_seconds': 60}})
+        app.extensions['db']._pool = FailingPool(errors.PoolError(message))
+        for _ in range(2):
+            assert app.test_client().get('/api/products/1').status_code == 500
+        assert app.extensions['db'].breaker.state == state
+
+    # read_timeout is only passed to drivers that know it (mysql-connector-python 9.1 rejects it)
+    from mysql.connector import constants
+    config = {'host': 'localhost', 'connection_timeout': 5, 'read_timeout': 10}
+    assert driver_config(config) == config
+    monkeypatch.delitem(constants.DEFAULT_CONFIGURATION, 'read_timeout')
+    assert driver_config(config) == {'host': 'localhost', 'connection_timeout': 5}
+
 # =============================
 
 if __name__ == '__main__':
@@ -0,0 +1,259 @@
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+# ================ Write-Behind Queue ================
+
+writeback_logger = logging.getLogger('writeback')
+
+
+class QueueFull(Exception):
+    # Raised when an update cannot be queued before the enqueue timeout (backpressure).
+    pass
+
+
+class JournalLocked(Exception):
+    # Raised when another process already writes to the same journal.
+    pass
+
+
+class WriteBehindQueue:
+    # Acknowledged product updates, coalesced per id and flushed to the DB in batches.
+    #
+    # Every update is appended to a local journal before it is acknowledged, so queued
+    # updates survive a crash and are replayed on the next start. Updates to the same id
+    # are merged field by field, last writer wins. A background thread hands the pending
+    # updates to `flush` when max_batch ids are pending or flush_seconds have passed,
+    # and the journal is compacted once the batch has been committed.
+    #
+    # Failed updates stay queued, except those `is_row_error(error)` blames on the row itself
+    # (e.g. a value out of range for its column): when a batch fails with such an error its
+    # ids are retried one at a time, and the ones rejected for their values are moved to the
+    # dead letters (kept in memory and appended to `<journal>.dead`) so one bad row cannot
+    # hold up the queue. Any other error (database down, circuit open) stops the retries and
+    # keeps the rest queued. Without is_row_error nothing is ever dropped.
+
+    def __init__(self, flush, journal_path, max_batch=100, flush_seconds=1.0,
+                 max_pending=1000, enqueue_timeout=1.0, fsync=True, is_row_error=None):
+        self._flush = flush
+        self._is_row_error = is_row_error or (lambda error: False)
+        self.journal_path = journal_path
+        self.max_batch = max_batch
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+        self._fsync = fsync
+
+        self._pending = {}
+        self._condition = threading.Condition()
+        # Only one batch is in flight at a time
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self.stats = {'enqueued': 0, 'coalesced': 0, 'flushed': 0, 'batches': 0, 'failures': 0, 'rejected': 0,
+                      'dead_lettered': 0}
+        # {'id', 'fields', 'error'} of the latest updates that could not be written
+        self.dead_letters = deque(maxlen=100)
+
+        self._lock_file = self._lock_journal()
+        self._recover()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._flush_loop, name='write-behind', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def in_free_slot(cls, flush, journal_path, **options):
+        # Open a queue on the first journal no other process holds: journal_path itself, then
+        # <name>.1<ext>, <name>.2<ext>, ... Every worker of a multi-process server configured
+        # with the same path gets its own journal, and a restarted worker replays the one an
+        # earlier process left in its slot.
+        name, extension = os.path.splitext(journal_path)
+        for slot in itertools.count():
+            path = journal_path if slot == 0 else f"{name}.{slot}{extension}"
+            try:
+                return cls(flush, path, **options)
+            except JournalLocked:
+                continue
+
+    def _lock_journal(self):
+        # Hold an exclusive lock next to the journal for the queue's lifetime. Compaction
+        # replaces the journal file, so a second process sharing it would drop acknowledged updates.
+        try:
+            import fcntl
+        except ImportError:
+            writeback_logger.warning("Cannot lock %s on this platform; use one journal per process",
+                                     self.journal_path)
+            return None
+
+        lock_file = open(self.journal_path + '.lock', 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise JournalLocked(f"{self.journal_path} is in use by another process")
+        return lock_file
+
+    def _recover(self):
+        # Load updates left in the journal by a previous run.
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write was never acknowledged
+                    continue
+                self._pending.setdefault(entry['id'], {}).update(entry['fields'])
+
+        if self._pending:
+            writeback_logger.warning("Recovered %d queued product updates from %s",
+                                     len(self._pending), self.journal_path)
+
+    def enqueue(self, id, fields):
+        # Durably queue an update. Blocks while the queue is full and raises QueueFull
+        # if no room frees up within enqueue_timeout.
+        line = json.dumps({'id': id, 'fields': fields}) + '\n'
+
+        with self._condition:
+            if self._closed:
+                raise QueueFull("Write-behind queue is closed")
+
+            deadline = time.monotonic() + self.enqueue_timeout
+            while id not in self._pending and len(self._pending) >= self.max_pending:
+                self._condition.notify_all()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['rejected'] += 1
+                    raise QueueFull("Too many pending product updates")
+                self._condition.wait(remaining)
+
+            self._journal.write(line)
+            self._journal.flush()
+            if self._fsync:
+                os.fsync(self._journal.fileno())
+
+            if id in self._pending:
+                self.stats['coalesced'] += 1
+            self._pending.setdefault(id, {}).update(fields)
+            self.stats['enqueued'] += 1
+
+            if len(self._pending) >= self.max_batch:
+                self._condition.notify_all()
+
+    def pending_count(self):
+        with self._condition:
+            return len(self._pending)
+
+    def _flush_loop(self):
+        retry = False
+        while True:
+            with self._condition:
+                # After a failed batch wait a full interval instead of retrying immediately
+                if not self._closed and (retry or len(self._pending) < self.max_batch):
+                    self._condition.wait(self.flush_seconds)
+                if self._closed:
+                    return
+            retry = not self.flush()
+
+    def flush(self):
+        # Write all pending updates in one batch. Returns False if some updates could not be
+        # written; they stay queued (and journaled) and are retried on the next flush.
+        with self._flush_lock:
+            with self._condition:
+                if not self._pending:
+                    return True
+                batch, self._pending = self._pending, {}
+                # Room has been freed for blocked writers
+                self._condition.notify_all()
+
+            failed = {}
+            try:
+                self._flush(batch)
+            except Exception as e:
+                writeback_logger.warning("Write-behind flush of %d updates failed: %s", len(batch), e)
+                failed = dict.fromkeys(batch, e)
+                if len(batch) > 1 and self._is_row_error(e):
+                    # Find the bad rows so the others can still be written
+                    failed = self._flush_one_by_one(batch)
+
+            rejected = {id: (batch[id], error) for id, error in failed.items() if self._is_row_error(error)}
+            retry = {id: batch[id] for id in failed if id not in rejected}
+            with self._condition:
+                self._dead_letter(rejected)
+                self.stats['flushed'] += len(batch) - len(failed)
+                if len(failed) < len(batch):
+                    self.stats['batches'] += 1
+                if retry:
+                    self.stats['failures'] += 1
+                    # Newer updates queued during the flush win over the failed ones
+                    for id, fields in self._pending.items():
+                        retry.setdefault(id, {}).update(fields)
+                    self._pending = retry
+                if len(retry) < len(batch):
+                    self._compact_journal()
+            return not retry
+
+    def _flush_one_by_one(self, batch):
+        # Write each update on its own; return {id: error} for the ones not written. Stops at
+        # the first error that is not about the row, which the remaining updates are given.
+        failed = {}
+        ids = list(batch)
+        for position, id in enumerate(ids):
+            try:
+                self._flush({id: batch[id]})
+            except Exception as e:
+                if not self._is_row_error(e):
+                    failed.update(dict.fromkeys(ids[position:], e))
+                    break
+                failed[id] = e
+        return failed
+
+    def _dead_letter(self, updates):
+        # Give up on {id: (fields, error)} updates rejected for their values.
+        if not updates:
+            return
+        with open(self.journal_path + '.dead', 'a', encoding='utf-8') as dead_letters:
+            for id, (fields, error) in updates.items():
+                writeback_logger.error("Dropping queued update of product %s %s: %s", id, fields, error)
+                entry = {'id': id, 'fields': fields, 'error': str(error)}
+                self.dead_letters.append(entry)
+                dead_letters.write(json.dumps(entry) + '\n')
+            dead_letters.flush()
+            if self._fsync:
+                os.fsync(dead_letters.fileno())
+        self.stats['dead_lettered'] += len(updates)
+
+    def _compact_journal(self):
+        # Rewrite the journal so it only holds updates that are still pending.
+        temporary_path = self.journal_path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as journal:
+            for id, fields in self._pending.items():
+                journal.write(json.dumps({'id': id, 'fields': fields}) + '\n')
+            journal.flush()
+            if self._fsync:
+                os.fsync(journal.fileno())
+
+        self._journal.close()
+        os.replace(temporary_path, self.journal_path)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def close(self):
+        # Stop accepting updates and flush everything still queued.
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+        # Whatever cannot be flushed now stays in the journal for the next start
+        self.flush()
+        with self._condition:
+            self._journal.close()
+        if self._lock_file is not None:
+            self._lock_file.close()